@@ -0,0 +1,115 @@
+import argparse
+import glob
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from DataBaseConnection import DataBaseConnection, backup_database
+
+
+SNAPSHOT_TIME_FORMAT = "%Y%m%d-%H%M%S-%f"
+
+
+def snapshot_name(db_file_path: str, when: datetime = None) -> str:
+    stem = os.path.splitext(os.path.basename(db_file_path))[0]
+    return f"{stem}-{(when or datetime.now()).strftime(SNAPSHOT_TIME_FORMAT)}.db"
+
+
+def list_snapshots(directory: str, db_file_path: str) -> list:
+    # oldest first; the timestamp format sorts lexically
+    stem = os.path.splitext(os.path.basename(db_file_path))[0]
+    return sorted(glob.glob(os.path.join(directory, f"{stem}-*.db")))
+
+
+def restore(snapshot_path: str, new_path: str, pages: int = -1) -> dict:
+    # restores into a new file; the live database is never overwritten
+    source = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    try:
+        integrity = source.execute("pragma quick_check").fetchone()[0]
+        if integrity != "ok":
+            raise sqlite3.DatabaseError(f"Snapshot {snapshot_path} failed quick_check: {integrity}")
+        return backup_database(source, new_path, pages, 0.)
+    finally:
+        source.close()
+
+
+class SnapshotScheduler:
+    def __init__(self, db_file_path: str, directory: str, interval: float = 3600., retention: int = 24,
+                 pages: int = 1024, sleep: float = 0.01, out=print):
+        self.db_file_path = db_file_path
+        self.directory = directory
+        self.interval = interval
+        self.retention = retention
+        self.pages = pages
+        self.sleep = sleep
+        self.history = list()
+        self._out = out
+        self._stop = threading.Event()
+        self._thread = None
+
+    def snapshot_now(self, connection: sqlite3.Connection = None) -> dict:
+        os.makedirs(self.directory, exist_ok=True)
+        target_path = os.path.join(self.directory, snapshot_name(self.db_file_path))
+        # a dedicated source connection keeps the copy off the application's connection
+        source = connection or DataBaseConnection.connect(self.db_file_path)
+        try:
+            stats = backup_database(source, target_path, self.pages, self.sleep)
+        finally:
+            if connection is None:
+                source.close()
+        stats["pruned"] = self.prune()
+        self.history.append(stats)
+        if self._out:
+            self._out(f"snapshot {stats['path']}: {stats['bytes']} bytes in {stats['seconds']:.2f}s "
+                      f"({stats['throughput'] / 1e6:.1f} MB/s, {stats['steps']} steps, {stats['restarts']} restarts)")
+        return stats
+
+    def prune(self) -> list:
+        snapshots = list_snapshots(self.directory, self.db_file_path)
+        expired = snapshots[:max(0, len(snapshots) - self.retention)]
+        for path in expired:
+            os.remove(path)
+        return expired
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshots", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.snapshot_now()
+            except Exception as e:
+                if self._out:
+                    self._out(f"snapshot failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Take or restore online snapshots of the catalog database.")
+    parser.add_argument("direction", choices=["snapshot", "restore"])
+    parser.add_argument("--db", default="db.db")
+    parser.add_argument("--directory", default="snapshots")
+    parser.add_argument("--retention", type=int, default=24)
+    parser.add_argument("--pages", type=int, default=1024)
+    parser.add_argument("--snapshot", help="snapshot to restore, defaults to the newest")
+    parser.add_argument("--target", help="new database file to restore into")
+    args = parser.parse_args()
+
+    if args.direction == "snapshot":
+        SnapshotScheduler(args.db, args.directory, retention=args.retention, pages=args.pages).snapshot_now()
+    else:
+        if not args.target:
+            parser.error("restore needs --target")
+        snapshot = args.snapshot or list_snapshots(args.directory, args.db)[-1]
+        stats = restore(snapshot, args.target)
+        print(f"restored {snapshot} to {stats['path']} in {stats['seconds']:.2f}s")
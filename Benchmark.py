@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from DataBaseConnection import DataBaseConnection
+import CatalogIO
+import DAOFactoryMethod
+import Game
+import Genre
+import Memento
+import Platform
+import User
+
+
+DEFAULT_SCALES = [10000, 100000, 1000000]
+PLATFORMS = 8
+GENRES = 16
+LINKS_PER_GAME = 2
+BULK_BATCH = 10000
+
+# calls per measured operation; whole-table reads are kept short on purpose
+ITERATIONS = {
+    "add": 200,
+    "filter": 50,
+    "update": 50,
+    "remove": 50,
+    "get_all": 3,
+    "login": 200,
+    "undo": 50
+}
+
+REGRESSION_RATIO = 1.2
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def measure(call, iterations: int, rows_per_call: int = 1) -> dict:
+    samples = list()
+    for i in range(iterations):
+        started = time.perf_counter()
+        call(i)
+        samples.append(time.perf_counter() - started)
+
+    # one extra call under tracemalloc, which would otherwise skew the timings
+    tracemalloc.start()
+    call(iterations)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sum(samples)
+    return {
+        "iterations": iterations,
+        "throughput": iterations * rows_per_call / total if total > 0 else 0.,
+        "p50": percentile(samples, 50),
+        "p99": percentile(samples, 99),
+        "peak_memory": peak
+    }
+
+
+def synthetic_game(i: int, rng: random.Random) -> dict:
+    return {
+        "name": f"game-{i}",
+        "price": Game.to_minor(round(rng.uniform(0, 100), 2)),
+        "platform_ids": rng.sample(range(1, PLATFORMS + 1), LINKS_PER_GAME),
+        "genre_ids": rng.sample(range(1, GENRES + 1), LINKS_PER_GAME)
+    }
+
+
+def build_catalog(dbcon: DataBaseConnection, games: int, rng: random.Random) -> dict:
+    con = dbcon.get_connection()
+    DAOFactoryMethod.add(DAOFactoryMethod.PlatformDAOFactory(dbcon),
+                         [Platform.Platform(f"platform-{i}") for i in range(PLATFORMS)])
+    DAOFactoryMethod.add(DAOFactoryMethod.GenreDAOFactory(dbcon),
+                         [Genre.Genre(f"genre-{i}") for i in range(GENRES)])
+    DAOFactoryMethod.add(DAOFactoryMethod.UserDAOFactory(dbcon), [User.User("bench", "bench", "admin")])
+
+    batches = 0
+    elapsed = 0.
+    for start in range(0, games, BULK_BATCH):
+        batch = [synthetic_game(n, rng) for n in range(start, min(start + BULK_BATCH, games))]
+        started = time.perf_counter()
+        CatalogIO.write_resolved_games(con, batch)
+        elapsed += time.perf_counter() - started
+        batches += 1
+    return {
+        "iterations": batches,
+        "throughput": games / elapsed if elapsed > 0 else 0.,
+        "seconds": elapsed
+    }
+
+
+def run_scale(dbcon: DataBaseConnection, db_file_path: str, games: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    dbcon.close_connection()
+    dbcon.open_connection(db_file_path, reinit_file=True)
+    dbcon.init_tables()
+
+    results = {"bulk_insert": build_catalog(dbcon, games, rng)}
+    gameDAO = DAOFactoryMethod.GameDAOFactory(dbcon).create_DAO()
+    platform_names = [f"platform-{i}" for i in range(PLATFORMS)]
+    genre_names = [f"genre-{i}" for i in range(GENRES)]
+
+    def existing(count: int) -> list:
+        sampled = list()
+        for game_id in rng.sample(range(1, games + 1), count):
+            _, name, price = gameDAO.filter([{"column": "id", "value": game_id, "op": "="}])[0]
+            sampled.append(Game.Game(name, price, set(), set()))
+        return sampled
+
+    def add(i):
+        gameDAO.add(Game.Game(f"added-{i}", 9.99, set(rng.sample(platform_names, LINKS_PER_GAME)),
+                              set(rng.sample(genre_names, LINKS_PER_GAME))))
+    results["add"] = measure(add, ITERATIONS["add"])
+
+    results["filter_name"] = measure(
+        lambda i: gameDAO.filter([{"column": "name", "value": f"game-{rng.randrange(games)}", "op": "="}]),
+        ITERATIONS["filter"])
+    results["filter_price"] = measure(
+        lambda i: gameDAO.filter([{"column": "price", "value": rng.uniform(0, 99.9), "op": ">"}]),
+        ITERATIONS["filter"])
+
+    targets = existing(ITERATIONS["update"] + 1)
+    results["update"] = measure(
+        lambda i: gameDAO.update(targets[i], Game.Game(targets[i].name, targets[i].price + 1, set(), set())),
+        ITERATIONS["update"])
+
+    results["get_all"] = measure(lambda i: gameDAO.get_all(), ITERATIONS["get_all"], games)
+
+    proxy = DAOFactoryMethod.DAOProxy(gameDAO)
+    results["login"] = measure(lambda i: proxy.login("bench", "bench"), ITERATIONS["login"])
+
+    history = Memento.GameDAOHistory(gameDAO)
+    undo_targets = existing(ITERATIONS["undo"] + 1)
+    for target in undo_targets:
+        gameDAO.update(target, Game.Game(target.name, target.price + 1, set(), set()))
+        history.backup()
+    results["undo"] = measure(lambda i: history.undo(), ITERATIONS["undo"])
+
+    victims = existing(ITERATIONS["remove"] + 1)
+    results["remove"] = measure(lambda i: gameDAO.remove(victims[i]), ITERATIONS["remove"])
+
+    results["file_size"] = os.path.getsize(db_file_path)
+    return results
+
+
+def run(scales: list, workdir: str, seed: int = 0, out=print) -> dict:
+    dbcon = DataBaseConnection.get_instance()
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed
+        },
+        "scales": dict()
+    }
+    for games in scales:
+        out(f"benchmarking {games} games")
+        results = run_scale(dbcon, os.path.join(workdir, f"bench-{games}.db"), games, seed)
+        report["scales"][str(games)] = results
+        for operation, result in results.items():
+            if isinstance(result, dict):
+                out(f"  {operation}: {result['throughput']:.0f}/s"
+                    + (f", p50 {result['p50'] * 1000:.3f}ms, p99 {result['p99'] * 1000:.3f}ms" if "p50" in result else ""))
+    dbcon.close_connection()
+    return report
+
+
+def compare(baseline: dict, current: dict, ratio: float = REGRESSION_RATIO) -> list:
+    regressions = list()
+    for scale, results in current["scales"].items():
+        for operation, result in results.items():
+            previous = baseline.get("scales", {}).get(scale, {}).get(operation)
+            if not isinstance(result, dict) or not isinstance(previous, dict):
+                continue
+            for metric in ("p50", "p99"):
+                if metric in result and previous.get(metric) and result[metric] > previous[metric] * ratio:
+                    regressions.append(f"{scale}/{operation} {metric}: "
+                                       f"{previous[metric] * 1000:.3f}ms -> {result[metric] * 1000:.3f}ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DAO layer on synthetic catalogs.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results to check for regressions")
+    parser.add_argument("--ratio", type=float, default=REGRESSION_RATIO,
+                        help="slowdown of p50/p99 that counts as a regression")
+    parser.add_argument("--workdir", help="where the benchmark databases are created")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run(args.scales, args.workdir or tmp, args.seed)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.ratio)
+        for regression in regressions:
+            print("regression:", regression)
+        sys.exit(1 if regressions else 0)
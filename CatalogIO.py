@@ -0,0 +1,265 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+from itertools import islice
+
+from DataBaseConnection import DataBaseConnection, PROFILES
+import Game
+
+
+LIST_SEPARATOR = "|"
+GAME_FIELDS = ["name", "price", "platforms", "genres"]
+REFERENCE_FIELDS = ["name"]
+
+
+class Progress:
+    def __init__(self, label: str = "", report_every: int = 100000, out=print):
+        self.label = label
+        self.report_every = report_every
+        self.rows = 0
+        self._out = out
+        self._started = time.perf_counter()
+        self._next_report = report_every
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    @property
+    def throughput(self) -> float:
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else 0.
+
+    def update(self, rows: int):
+        self.rows += rows
+        if self._out and self.rows >= self._next_report:
+            self._next_report = (self.rows // self.report_every + 1) * self.report_every
+            self.report()
+
+    def report(self):
+        self._out(f"{self.label}: {self.rows} rows, {self.elapsed:.1f}s, {self.throughput:.0f} rows/s")
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Unknown catalog format: {path}")
+
+
+def read_records(path: str, fmt: str = None):
+    fmt = fmt or detect_format(path)
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def split_names(value) -> list:
+    # CSV carries lists as "a|b", JSONL as real arrays
+    if value is None or value == "":
+        return list()
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    return [name.strip() for name in value if name.strip()]
+
+
+def parse_reference(record: dict) -> tuple:
+    name = (record.get("name") or "").strip()
+    if not name:
+        raise ValueError(f"Missing name: {record}")
+    return (name,)
+
+
+def parse_game(record: dict) -> dict:
+    name = (record.get("name") or "").strip()
+    if not name:
+        raise ValueError(f"Missing name: {record}")
+    return {
+        "name": name,
+        # minor units from here on, files keep prices in currency units
+        "price": Game.to_minor(record.get("price") or 0),
+        "platforms": split_names(record.get("platforms")),
+        "genres": split_names(record.get("genres"))
+    }
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def name_index(con: sqlite3.Connection, table: str) -> dict:
+    return {name: id_ for id_, name in con.execute(f"""select id, name from {table}""")}
+
+
+def import_references(dbcon: DataBaseConnection, table: str, path: str, fmt: str = None,
+                      batch_size: int = 10000, progress: Progress = None) -> int:
+    con = dbcon.get_connection()
+    statement = f"""insert into {table} (name) values (?)"""
+    progress = progress or Progress(table)
+    for batch in batched(map(parse_reference, read_records(path, fmt)), batch_size):
+        with con:
+            con.executemany(statement, batch)
+        progress.update(len(batch))
+    return progress.rows
+
+
+def import_platforms(dbcon: DataBaseConnection, path: str, fmt: str = None,
+                     batch_size: int = 10000, progress: Progress = None) -> int:
+    return import_references(dbcon, "platforms", path, fmt, batch_size, progress)
+
+
+def import_genres(dbcon: DataBaseConnection, path: str, fmt: str = None,
+                  batch_size: int = 10000, progress: Progress = None) -> int:
+    return import_references(dbcon, "genres", path, fmt, batch_size, progress)
+
+
+def resolve_game(game: dict, platforms: dict, genres: dict) -> dict:
+    try:
+        platform_ids = [platforms[platform] for platform in game["platforms"]]
+        genre_ids = [genres[genre] for genre in game["genres"]]
+    except KeyError:
+        raise sqlite3.IntegrityError(f"Unknown platform or genre in {game}")
+    return {
+        "name": game["name"],
+        "price": game["price"],
+        "platform_ids": platform_ids,
+        "genre_ids": genre_ids
+    }
+
+
+def write_resolved_games(con: sqlite3.Connection, games: list):
+    bs_game = """insert into games (name, price) values (?, ?)"""
+    bs_game_platforms = """insert into game_platforms (game_id, platform_id) values (?, ?)"""
+    bs_game_genres = """insert into game_genres (game_id, genre_id) values (?, ?)"""
+
+    with con:
+        cursor = con.cursor()
+        for game in games:
+            cursor.execute(bs_game, (game["name"], game["price"]))
+            game_id = cursor.lastrowid
+            cursor.executemany(bs_game_platforms, [(game_id, id_) for id_ in game["platform_ids"]])
+            cursor.executemany(bs_game_genres, [(game_id, id_) for id_ in game["genre_ids"]])
+
+
+def write_games(con: sqlite3.Connection, games: list, platforms: dict, genres: dict):
+    write_resolved_games(con, [resolve_game(game, platforms, genres) for game in games])
+
+
+def import_games(dbcon: DataBaseConnection, path: str, fmt: str = None,
+                 batch_size: int = 10000, progress: Progress = None) -> int:
+    con = dbcon.get_connection()
+    # resolve names once for the whole file instead of once per game
+    platforms = name_index(con, "platforms")
+    genres = name_index(con, "genres")
+    progress = progress or Progress("games")
+    for batch in batched(map(parse_game, read_records(path, fmt)), batch_size):
+        write_games(con, batch, platforms, genres)
+        progress.update(len(batch))
+    return progress.rows
+
+
+def stream_games(con: sqlite3.Connection):
+    statement = """select name, price,
+        (select json_group_array(platforms.name) from game_platforms
+            join platforms on platforms.id = game_platforms.platform_id
+            where game_platforms.game_id = games.id),
+        (select json_group_array(genres.name) from game_genres
+            join genres on genres.id = game_genres.genre_id
+            where game_genres.game_id = games.id)
+        from games order by id"""
+    for name, price, platforms, genres in con.execute(statement):
+        yield {
+            "name": name,
+            "price": float(Game.from_minor(price)),
+            "platforms": json.loads(platforms),
+            "genres": json.loads(genres)
+        }
+
+
+def stream_references(con: sqlite3.Connection, table: str):
+    for (name,) in con.execute(f"""select name from {table} order by id"""):
+        yield {"name": name}
+
+
+def write_records(records, path: str, fields: list, fmt: str = None, progress: Progress = None) -> int:
+    fmt = fmt or detect_format(path)
+    progress = progress or Progress(os.path.basename(path))
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+        for record in records:
+            if fmt == "csv":
+                writer.writerow({key: LIST_SEPARATOR.join(value) if isinstance(value, list) else value
+                                 for key, value in record.items()})
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            progress.update(1)
+    return progress.rows
+
+
+def export_games(dbcon: DataBaseConnection, path: str, fmt: str = None, progress: Progress = None) -> int:
+    return write_records(stream_games(dbcon.get_connection()), path, GAME_FIELDS, fmt, progress or Progress("games"))
+
+
+def export_platforms(dbcon: DataBaseConnection, path: str, fmt: str = None, progress: Progress = None) -> int:
+    return write_records(stream_references(dbcon.get_connection(), "platforms"), path, REFERENCE_FIELDS, fmt,
+                         progress or Progress("platforms"))
+
+
+def export_genres(dbcon: DataBaseConnection, path: str, fmt: str = None, progress: Progress = None) -> int:
+    return write_records(stream_references(dbcon.get_connection(), "genres"), path, REFERENCE_FIELDS, fmt,
+                         progress or Progress("genres"))
+
+
+IMPORTERS = {
+    "platforms": import_platforms,
+    "genres": import_genres,
+    "games": import_games
+}
+
+EXPORTERS = {
+    "platforms": export_platforms,
+    "genres": export_genres,
+    "games": export_games
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import or export the game catalog as CSV or JSON Lines.")
+    parser.add_argument("direction", choices=["import", "export"])
+    parser.add_argument("entity", choices=list(IMPORTERS))
+    parser.add_argument("path")
+    parser.add_argument("--db", default="db.db")
+    parser.add_argument("--profile", choices=list(PROFILES), default="balanced",
+                        help="profile for the connection; imports switch to bulk-load while they run")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    dbcon = DataBaseConnection.get_instance()
+    dbcon.open_connection(args.db, profile=args.profile)
+    dbcon.init_tables()
+
+    progress = Progress(args.entity)
+    if args.direction == "import":
+        with dbcon.use_profile("bulk-load"):
+            IMPORTERS[args.entity](dbcon, args.path, args.format, args.batch_size, progress)
+    else:
+        EXPORTERS[args.entity](dbcon, args.path, args.format, progress)
+    progress.report()
+    dbcon.close_connection()
@@ -0,0 +1,80 @@
+import json
+import time
+
+from DataBaseConnection import DataBaseConnection
+
+
+def latest_sequence(dbcon: DataBaseConnection) -> int:
+    con = dbcon.get_connection()
+    # sqlite_sequence survives truncate(), max(seq) would not
+    row = con.execute("""select seq from sqlite_sequence where name = 'changelog'""").fetchone()
+    return row[0] if row else 0
+
+
+def read_since(dbcon: DataBaseConnection, seq: int, limit: int = 1000) -> list:
+    con = dbcon.get_connection()
+    statement = """select seq, table_name, operation, row_id, data, created_at from changelog
+        where seq > ? order by seq limit ?"""
+    return [{
+        "seq": seq_,
+        "table": table,
+        "operation": operation,
+        "row_id": row_id,
+        "data": json.loads(data),
+        "created_at": created_at
+    } for seq_, table, operation, row_id, data, created_at in con.execute(statement, (seq, limit))]
+
+
+def truncate(dbcon: DataBaseConnection, before_seq: int = None) -> int:
+    # drops entries every registered consumer has already committed past
+    con = dbcon.get_connection()
+    with con:
+        if before_seq is None:
+            before_seq = con.execute("""select min(position) from changelog_consumers""").fetchone()[0]
+            if before_seq is None:
+                return 0
+        return con.execute("""delete from changelog where seq <= ?""", (before_seq,)).rowcount
+
+
+class ChangeLogConsumer:
+    def __init__(self, dbcon: DataBaseConnection, name: str = None, batch_size: int = 1000, position: int = None):
+        self._dbcon = dbcon
+        self.name = name
+        self.batch_size = batch_size
+        if position is None:
+            position = self._stored_position() if name else 0
+        self.position = position
+
+    def _stored_position(self) -> int:
+        con = self._dbcon.get_connection()
+        row = con.execute("""select position from changelog_consumers where name = ?""", (self.name,)).fetchone()
+        return row[0] if row else 0
+
+    def poll(self) -> list:
+        changes = read_since(self._dbcon, self.position, self.batch_size)
+        if changes:
+            self.position = changes[-1]["seq"]
+        return changes
+
+    def commit(self, seq: int = None):
+        # named consumers persist their offset so they resume where they stopped
+        if seq is not None:
+            self.position = seq
+        if not self.name:
+            return
+        con = self._dbcon.get_connection()
+        with con:
+            con.execute("""insert into changelog_consumers (name, position) values (?, ?)
+                on conflict (name) do update set position = excluded.position""", (self.name, self.position))
+
+    def lag(self) -> int:
+        return latest_sequence(self._dbcon) - self.position
+
+    def follow(self, interval: float = 1., stop=None):
+        # yields non-empty batches; sleeps only when caught up
+        while not (stop and stop()):
+            changes = self.poll()
+            if changes:
+                yield changes
+            else:
+                time.sleep(interval)
@@ -0,0 +1,93 @@
+import functools
+import random
+import sqlite3
+import threading
+import time
+
+
+RETRIABLE_CODES = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+class ContentionPolicy(object):
+    def __init__(self, busy_timeout: float = 5., max_retries: int = 5, backoff_base: float = 0.01,
+                 backoff_max: float = 1., immediate_writes: bool = True):
+        self.busy_timeout = busy_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.immediate_writes = immediate_writes
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {
+            "calls": 0,
+            "busy_errors": 0,
+            "retries": 0,
+            "gave_up": 0,
+            "waited_seconds": 0.
+        }
+
+    def connect_kwargs(self) -> dict:
+        kwargs = {"timeout": self.busy_timeout}
+        if self.immediate_writes:
+            # the implicit BEGIN before the first write becomes BEGIN IMMEDIATE, so a
+            # transaction takes the write lock up front instead of failing to upgrade later
+            kwargs["isolation_level"] = "IMMEDIATE"
+        return kwargs
+
+    @staticmethod
+    def is_retriable(error: Exception) -> bool:
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        code = getattr(error, "sqlite_errorcode", None)
+        if code is not None:
+            return code & 0xff in RETRIABLE_CODES
+        message = str(error).lower()
+        return "locked" in message or "busy" in message
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter keeps competing processes from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def run(self, call, *args, **kwargs):
+        # only the outermost DAO call retries; nested calls share its transaction
+        if getattr(self._local, "depth", 0):
+            return call(*args, **kwargs)
+        self._local.depth = 1
+        try:
+            self._count("calls")
+            attempt = 0
+            while True:
+                try:
+                    return call(*args, **kwargs)
+                except Exception as e:
+                    if not self.is_retriable(e):
+                        raise
+                    self._count("busy_errors")
+                    if attempt >= self.max_retries:
+                        self._count("gave_up")
+                        raise
+                    delay = self.backoff(attempt)
+                    self._count("retries")
+                    self._count("waited_seconds", delay)
+                    time.sleep(delay)
+                    attempt += 1
+        finally:
+            self._local.depth = 0
+
+    def _count(self, key: str, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+def retrying(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        policy = getattr(self._dbcon, "contention", None)
+        if policy is None:
+            return method(self, *args, **kwargs)
+        return policy.run(method, self, *args, **kwargs)
+    return wrapper
@@ -1,10 +1,19 @@
+import json
+import re
 import sqlite3
 from abc import ABC, abstractmethod
+from decimal import ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
 
 import Genre
 import Platform
 from SubjectObserver import Subject, Observer, DAOUpdateObserver
 from DataBaseConnection import DataBaseConnection
+from Instrumentation import instrumented
+from Contention import retrying
+from StatementCache import shape_cache
+from Deadline import bounded, within
+from Session import identity_mapped
+import Session
 import Game
 import Memento
 import User
@@ -102,17 +111,20 @@ class DAOProxy(DAO):
         "user": -2
     }
 
-    def __init__(self, subject: DAO):
+    def __init__(self, subject: DAO, timeout: float = None):
         self._subject = subject
         self._current_user_access = 0
+        # ambient deadline in seconds for every call made through the proxy
+        self._timeout = timeout
 
     def login(self, login: str, password: str) -> bool:
-        current_user = filter(UserDAOFactory(self._subject._dbcon),
-                              [{
-                                  "column": "login",
-                                  "value": login,
-                                  "op": "="
-                              }])
+        with within(self._timeout):
+            current_user = filter(UserDAOFactory(self._subject._dbcon),
+                                  [{
+                                      "column": "login",
+                                      "value": login,
+                                      "op": "="
+                                  }])
         if any(current_user):
             assert len(current_user) == 1
             current_user = {
@@ -131,21 +143,32 @@ class DAOProxy(DAO):
     def get_all(self) -> list:
         if self.check_access():
             if self._current_user_access >= self._access["user"]:
-                return self._subject.get_all()
+                with within(self._timeout):
+                    return self._subject.get_all()
             else:
                 return list()
 
     def filter(self, params: list) -> list:
         if self.check_access():
             if self._current_user_access >= self._access["user"]:
-                return self._subject.filter(params)
+                with within(self._timeout):
+                    return self._subject.filter(params)
+            else:
+                return list()
+
+    def search(self, text: str, limit: int = 20) -> list:
+        if self.check_access():
+            if self._current_user_access >= self._access["user"]:
+                with within(self._timeout):
+                    return self._subject.search(text, limit)
             else:
                 return list()
 
     def add(self, object_):
         if self.check_access():
             if self._current_user_access >= self._access["admin"]:
-                return self._subject.add(object_)
+                with within(self._timeout):
+                    return self._subject.add(object_)
             else:
                 raise PermissionError("Unauthorized.")
         else:
@@ -154,7 +177,8 @@ class DAOProxy(DAO):
     def remove(self, object_):
         if self.check_access():
             if self._current_user_access >= self._access["admin"]:
-                return self._subject.remove(object_)
+                with within(self._timeout):
+                    return self._subject.remove(object_)
             else:
                 raise PermissionError("Unauthorized.")
         else:
@@ -163,7 +187,8 @@ class DAOProxy(DAO):
     def update(self, object_old, object_new):
         if self.check_access():
             if self._current_user_access >= self._access["admin"]:
-                return self._subject.update(object_old, object_new)
+                with within(self._timeout):
+                    return self._subject.update(object_old, object_new)
             else:
                 raise PermissionError("Unauthorized.")
         else:
@@ -176,6 +201,9 @@ class RoleDAO(DAO):
     def __init__(self, dbcon: DataBaseConnection = None):
         self._dbcon = dbcon
 
+    @instrumented
+    @bounded
+    @retrying
     def get_all(self) -> list:
         con = self._dbcon.get_connection()
         statement = """select * from roles;"""
@@ -185,13 +213,13 @@ class RoleDAO(DAO):
                 all.append(row)
         return all
 
+    @instrumented
+    @bounded
+    @retrying
     def filter(self, params: list) -> list:
         con = self._dbcon.get_connection()
         if any(params):
-            base_statement = """select * from roles where """
-            param_statements = [f"{param['column']}{param['op']}:{param['column']}" for param in params]
-            final_statement = base_statement + " and ".join(param_statements)
-            query_params = {param["column"]: param["value"] for param in params}
+            final_statement, query_params = shape_cache.build("""select * from roles where {where}""", params)
             filtered = list()
             with con:
                 exec = con.execute(final_statement, query_params)
@@ -201,6 +229,8 @@ class RoleDAO(DAO):
         else:
             return self.get_all()
 
+    @instrumented
+    @retrying
     def add(self, role: str):
         con = self._dbcon.get_connection()
         base_statement = """insert into roles (name) values (?)"""
@@ -208,6 +238,8 @@ class RoleDAO(DAO):
         with con:
             con.execute(base_statement, (role,))
 
+    @instrumented
+    @retrying
     def remove(self, object_):
         con = self._dbcon.get_connection()
         base_statement = """delete from roles where id=:id"""
@@ -224,6 +256,8 @@ class RoleDAO(DAO):
             for td in to_delete:
                 con.execute(base_statement, {"id": td[0]})
 
+    @instrumented
+    @retrying
     def update(self, object_old, object_new):
         con = self._dbcon.get_connection()
         base_statement = """update roles set name=:name where id=:id"""
@@ -250,6 +284,9 @@ class UserDAO(DAO):
     def __init__(self, dbcon: DataBaseConnection):
         self._dbcon = dbcon
 
+    @instrumented
+    @bounded
+    @retrying
     def get_all(self) -> list:
         con = self._dbcon.get_connection()
         statement = """select login, roles.role role, phash from users join roles on roles.id = users.role_id;"""
@@ -259,13 +296,15 @@ class UserDAO(DAO):
                 all.append(row)
         return all
 
+    @instrumented
+    @bounded
+    @retrying
     def filter(self, params: list) -> list:
         con = self._dbcon.get_connection()
         if any(params):
-            base_statement = """select login, roles.name role, phash from users join roles on roles.id = users.role_id where """
-            param_statements = [f"{param['column']}{param['op']}:{param['column']}" for param in params]
-            final_statement = base_statement + " and ".join(param_statements)
-            query_params = {param["column"]: param["value"] for param in params}
+            final_statement, query_params = shape_cache.build(
+                """select login, roles.name role, phash from users join roles on roles.id = users.role_id where {where}""",
+                params)
             filtered = list()
             with con:
                 exec = con.execute(final_statement, query_params)
@@ -276,6 +315,8 @@ class UserDAO(DAO):
             return self.get_all()
         pass
 
+    @instrumented
+    @retrying
     def add(self, object_: User.User):
         con = self._dbcon.get_connection()
 
@@ -293,6 +334,8 @@ class UserDAO(DAO):
             cursor = con.cursor()
             cursor.execute(bs_users, (role_id, object_.login, object_.password))
 
+    @instrumented
+    @retrying
     def remove(self, object_):
         con = self._dbcon.get_connection()
         base_statement = """delete from users where id=:id"""
@@ -309,6 +352,8 @@ class UserDAO(DAO):
             for td in to_delete:
                 con.execute(base_statement, {"id": td[0]})
 
+    @instrumented
+    @retrying
     def update(self, object_old: User.User, object_new: User.User):
         con = self._dbcon.get_connection()
         base_statement = """update users set role_id=:role_id, login=:login, phash=:phash where id=:id"""
@@ -339,43 +384,101 @@ class UserDAO(DAO):
                 })
 
 
+def catalog_price(game: Game.Game) -> int:
+    # the catalog keeps one currency; converting between currencies is not the DAO's job
+    if game.currency != Game.DEFAULT_CURRENCY:
+        raise ValueError(f"Catalog prices are in {Game.DEFAULT_CURRENCY}, got {game.currency}.")
+    return game.price_minor
+
+
+# a bound between two minor units is moved to the one that keeps the comparison's meaning
+PRICE_BOUND_ROUNDING = {
+    ">": ROUND_FLOOR,
+    "<=": ROUND_FLOOR,
+    "<": ROUND_CEILING,
+    ">=": ROUND_CEILING
+}
+
+
+# a price between two minor units equals no stored price; "is null" never and "is not null" always holds on games
+INEXACT_PRICE_OPS = {
+    "=": " is ",
+    "==": " is ",
+    "!=": " is not ",
+    "<>": " is not "
+}
+
+
+def minor_params(params: list) -> list:
+    # callers filter on prices in currency units, the games table holds minor units
+    return [minor_param(param) if param["column"] == "price" else param for param in params]
+
+
+def minor_param(param: dict) -> dict:
+    op = param["op"].strip()
+    minor = Game.to_minor(param["value"], rounding=PRICE_BOUND_ROUNDING.get(op, ROUND_HALF_UP))
+    if op in INEXACT_PRICE_OPS and not Game.is_whole_minor(param["value"]):
+        return dict(param, value=None, op=INEXACT_PRICE_OPS[op])
+    return dict(param, value=minor)
+
+
+def price_summary(count: int, min_price: int, max_price: int, total: int) -> dict:
+    # integer totals stay exact, only the average is divided
+    return {
+        "count": count,
+        "min": Game.from_minor(min_price) if count else None,
+        "max": Game.from_minor(max_price) if count else None,
+        "avg": Game.from_minor(total) / count if count else None
+    }
+
+
 class GameDAO(DAO, Subject):
     _last_action: dict = None
     _observers: list = list()
     _dbcon: DataBaseConnection = None
+    # sql for the id of a new game; null lets sqlite assign it
+    _id_expression: str = "null"
 
     def __init__(self, dbcon: DataBaseConnection = None):
         self._dbcon = dbcon
 
+    @instrumented
+    @identity_mapped("games")
+    @bounded
+    @retrying
     def get_all(self) -> list:
-        con = self._dbcon.get_connection()
+        con = self._dbcon.get_read_connection()
         statement = """select * from games;"""
         all = list()
         with con:
             for row in con.execute(statement):
                 all.append(row)
-        return all
+        return Game.priced(all)
 
+    @instrumented
+    @identity_mapped("games")
+    @bounded
+    @retrying
     def filter(self, params: list) -> list:
-        con = self._dbcon.get_connection()
+        con = self._dbcon.get_read_connection()
         if any(params):
-            base_statement = """select * from games where """
-            param_statements = [f"{param['column']}{param['op']}:{param['column']}" for param in params]
-            final_statement = base_statement + " and ".join(param_statements)
-            query_params = {param["column"]: param["value"] for param in params}
+            final_statement, query_params = shape_cache.build("""select * from games where {where}""",
+                                                              minor_params(params))
             filtered = list()
             with con:
                 exec = con.execute(final_statement, query_params)
                 for row in exec:  # protected from SQL injection
                     filtered.append(row)
-            return filtered
+            return Game.priced(filtered)
         else:
             return self.get_all()
 
+    @instrumented
+    @retrying
     def add(self, game: Game.Game):
         con = self._dbcon.get_connection()
 
-        bs_game = """insert into games (name, price) values (?, ?)"""
+        bs_game = f"""insert into games (id, name, price) values ({self._id_expression}, ?, ?)"""
         bs_game_platforms = """insert into game_platforms (game_id, platform_id) values (?, ?)"""
         bs_game_genres = """insert into game_genres (game_id, genre_id) values (?, ?)"""
 
@@ -386,7 +489,7 @@ class GameDAO(DAO, Subject):
 
         with con:
             cursor = con.cursor()
-            cursor.execute(bs_game, (game.name, game.price))
+            cursor.execute(bs_game, (game.name, catalog_price(game)))
             game_id = cursor.lastrowid
 
             for platform in list(game.platform_ids):
@@ -409,6 +512,8 @@ class GameDAO(DAO, Subject):
         }
         self.notify()
 
+    @instrumented
+    @retrying
     def remove(self, object_):
         con = self._dbcon.get_connection()
         base_statement = """delete from games where id=:id"""
@@ -420,7 +525,7 @@ class GameDAO(DAO, Subject):
             },
             {
                 "column": "price",
-                "value": object_.price,
+                "value": Game.from_minor(catalog_price(object_)),
                 "op": "="
             }
         ]
@@ -436,6 +541,8 @@ class GameDAO(DAO, Subject):
         }
         self.notify()
 
+    @instrumented
+    @retrying
     def update(self, object_old: Game.Game, object_new: Game.Game):
         con = self._dbcon.get_connection()
         base_statement = """update games set name=:name, price=:price where id=:id"""
@@ -448,7 +555,7 @@ class GameDAO(DAO, Subject):
             },
             {
                 "column": "price",
-                "value": object_old.price,
+                "value": Game.from_minor(catalog_price(object_old)),
                 "op": "="
             }
         ]
@@ -459,7 +566,7 @@ class GameDAO(DAO, Subject):
                 con.execute(base_statement, {
                     "id": tu[0],
                     "name": object_new.name,
-                    "price": object_new.price,
+                    "price": catalog_price(object_new),
                 })
 
         self._last_action = {
@@ -469,6 +576,122 @@ class GameDAO(DAO, Subject):
         }
         self.notify()
 
+    @instrumented
+    @identity_mapped("games")
+    @bounded
+    @retrying
+    def search(self, text: str, limit: int = 20) -> list:
+        con = self._dbcon.get_read_connection()
+        # every word must match as a prefix; \w+ never contains quotes, so terms are safe to quote
+        terms = re.findall(r"\w+", text)
+        if not terms:
+            return list()
+        query = " ".join('"' + term + '"*' for term in terms)
+        statement = """select games.* from games_fts join games on games.id = games_fts.rowid
+            where games_fts match :query order by rank limit :limit"""
+        with con:
+            return Game.priced(con.execute(statement, {"query": query, "limit": limit}).fetchall())
+
+    @instrumented
+    @bounded
+    @retrying
+    def count_by_genre(self, params: list = None) -> list:
+        return self._count_by("genre", params)
+
+    @instrumented
+    @bounded
+    @retrying
+    def count_by_platform(self, params: list = None) -> list:
+        return self._count_by("platform", params)
+
+    @instrumented
+    @bounded
+    def price_stats(self, params: list = None) -> dict:
+        return price_summary(*self.price_totals(params))
+
+    @bounded
+    @retrying
+    def price_totals(self, params: list = None) -> tuple:
+        # (count, min, max, total) in minor units, exact integers that can be merged across databases
+        con = self._dbcon.get_read_connection()
+        if params:
+            statement, query_params = shape_cache.build(
+                """select count(*), min(price), max(price), sum(price) from games where {where}""",
+                minor_params(params), "games.")
+        else:
+            # min/max are single seeks on games_price_idx, count/total come from the summary row
+            statement = """select game_count,
+                (select min(price) from games), (select max(price) from games), price_total
+                from game_price_stats where id = 1"""
+            query_params = ()
+        with con:
+            row = con.execute(statement, query_params).fetchone()
+        return tuple(row) if row else (0, None, None, None)
+
+    @instrumented
+    @bounded
+    @retrying
+    def catalog_summary(self, params: list = None) -> dict:
+        return {
+            "genres": self.count_by_genre(params),
+            "platforms": self.count_by_platform(params),
+            "price": self.price_stats(params)
+        }
+
+    @instrumented
+    @bounded
+    @retrying
+    def listings(self, params: list = None, limit: int = None) -> list:
+        # (id, name, price, platform names, genre names) from the game_listings read model
+        rows = self._listings("""select * from game_listings where {where} order by price""", params or list(), limit)
+        return [(id_, name, price, json.loads(platforms), json.loads(genres))
+                for id_, name, price, platforms, genres in rows]
+
+    @instrumented
+    @bounded
+    @retrying
+    def listings_by_platform(self, platform: str, params: list = None, limit: int = None) -> list:
+        return self._listings("""select id, name, price from platform_listings where {where} order by price""",
+                              [{"column": "platform", "value": platform, "op": "="}] + (params or list()), limit)
+
+    @instrumented
+    @bounded
+    @retrying
+    def listings_by_genre(self, genre: str, params: list = None, limit: int = None) -> list:
+        return self._listings("""select id, name, price from genre_listings where {where} order by price""",
+                              [{"column": "genre", "value": genre, "op": "="}] + (params or list()), limit)
+
+    def _listings(self, template: str, params: list, limit: int = None) -> list:
+        con = self._dbcon.get_read_connection()
+        if params:
+            statement, query_params = shape_cache.build(template, minor_params(params))
+        else:
+            statement, query_params = template.replace(" where {where}", ""), ()
+        if limit is not None:
+            statement, query_params = statement + " limit ?", query_params + (limit,)
+        with con:
+            return Game.priced(con.execute(statement, query_params).fetchall())
+
+    def _count_by(self, reference: str, params: list = None) -> list:
+        con = self._dbcon.get_read_connection()
+        table = f"{reference}s"
+        link_table = f"game_{reference}s"
+        if params:
+            template = f"""select {table}.id, {table}.name, coalesce(matched.game_count, 0) from {table}
+                left join (
+                    select {link_table}.{reference}_id ref_id, count(*) game_count from {link_table}
+                    join games on games.id = {link_table}.game_id
+                    where {{where}}
+                    group by {link_table}.{reference}_id
+                ) matched on matched.ref_id = {table}.id"""
+            statement, query_params = shape_cache.build(template, minor_params(params), "games.")
+        else:
+            statement = f"""select {table}.id, {table}.name, coalesce(counts.game_count, 0) from {table}
+                left join {reference}_game_counts counts on counts.{reference}_id = {table}.id"""
+            query_params = ()
+        with con:
+            return con.execute(statement, query_params).fetchall()
+
     def attach(self, observer: Observer) -> None:
         self._observers.append(observer)
 
@@ -498,8 +721,12 @@ class PlatformDAO(DAO, Subject):
     def __init__(self, dbcon: DataBaseConnection = None):
         self._dbcon = dbcon
 
+    @instrumented
+    @identity_mapped("platforms")
+    @bounded
+    @retrying
     def get_all(self) -> list:
-        con = self._dbcon.get_connection()
+        con = self._dbcon.get_read_connection()
         statement = """select * from platforms;"""
         all = list()
         with con:
@@ -507,13 +734,14 @@ class PlatformDAO(DAO, Subject):
                 all.append(row)
         return all
 
+    @instrumented
+    @identity_mapped("platforms")
+    @bounded
+    @retrying
     def filter(self, params: list) -> list:
-        con = self._dbcon.get_connection()
+        con = self._dbcon.get_read_connection()
         if any(params):
-            base_statement = """select * from platforms where """
-            param_statements = [f"{param['column']}{param['op']}:{param['column']}" for param in params]
-            final_statement = base_statement + " and ".join(param_statements)
-            query_params = {param["column"]: param["value"] for param in params}
+            final_statement, query_params = shape_cache.build("""select * from platforms where {where}""", params)
             filtered = list()
             with con:
                 exec = con.execute(final_statement, query_params)
@@ -523,6 +751,8 @@ class PlatformDAO(DAO, Subject):
         else:
             return self.get_all()
 
+    @instrumented
+    @retrying
     def add(self, platform: Platform.Platform):
         con = self._dbcon.get_connection()
         base_statement = """insert into platforms (name) values (?)"""
@@ -536,6 +766,8 @@ class PlatformDAO(DAO, Subject):
         }
         self.notify()
 
+    @instrumented
+    @retrying
     def remove(self, object_):
         con = self._dbcon.get_connection()
         base_statement = """delete from platforms where id=:id"""
@@ -558,6 +790,8 @@ class PlatformDAO(DAO, Subject):
         }
         self.notify()
 
+    @instrumented
+    @retrying
     def update(self, object_old: Platform.Platform, object_new: Platform.Platform):
         con = self._dbcon.get_connection()
         base_statement = """update platforms set name=:name where id=:id"""
@@ -603,8 +837,12 @@ class GenreDAO(DAO, Subject):
     def __init__(self, dbcon: DataBaseConnection = None):
         self._dbcon = dbcon
 
+    @instrumented
+    @identity_mapped("genres")
+    @bounded
+    @retrying
     def get_all(self) -> list:
-        con = self._dbcon.get_connection()
+        con = self._dbcon.get_read_connection()
         statement = """select * from genres;"""
         all = list()
         with con:
@@ -612,13 +850,14 @@ class GenreDAO(DAO, Subject):
                 all.append(row)
         return all
 
+    @instrumented
+    @identity_mapped("genres")
+    @bounded
+    @retrying
     def filter(self, params: list) -> list:
-        con = self._dbcon.get_connection()
+        con = self._dbcon.get_read_connection()
         if any(params):
-            base_statement = """select * from genres where """
-            param_statements = [f"{param['column']}{param['op']}:{param['column']}" for param in params]
-            final_statement = base_statement + " and ".join(param_statements)
-            query_params = {param["column"]: param["value"] for param in params}
+            final_statement, query_params = shape_cache.build("""select * from genres where {where}""", params)
             filtered = list()
             with con:
                 exec = con.execute(final_statement, query_params)
@@ -628,6 +867,8 @@ class GenreDAO(DAO, Subject):
         else:
             return self.get_all()
 
+    @instrumented
+    @retrying
     def add(self, genre: Genre.Genre):
         con = self._dbcon.get_connection()
         base_statement = """insert into genres (name) values (?)"""
@@ -641,6 +882,8 @@ class GenreDAO(DAO, Subject):
         }
         self.notify()
 
+    @instrumented
+    @retrying
     def remove(self, object_):
         con = self._dbcon.get_connection()
         base_statement = """delete from genres where id=:id"""
@@ -663,6 +906,8 @@ class GenreDAO(DAO, Subject):
         }
         self.notify()
 
+    @instrumented
+    @retrying
     def update(self, object_old: Genre.Genre, object_new: Genre.Genre):
         con = self._dbcon.get_connection()
         base_statement = """update genres set name=:name where id=:id"""
@@ -728,6 +973,7 @@ if __name__ == "__main__":
     PZ2 = False
     PZ3 = False
     PZ4 = True
+    SESSION = True
 
     dbcon = DataBaseConnection.get_instance()
     dbcon.open_connection("db.db", reinit_file=True)
@@ -774,6 +1020,14 @@ if __name__ == "__main__":
     gameBuilder.add_platform_ids(["pc"])
     add(gameDAOFactory, [gameBuilder.get_object()])
 
+    if SESSION:
+        # get() and a DAO read in one session hand out the same row, prices in currency units
+        with Session.Session(dbcon) as session:
+            loaded = session.get("games", 1)
+            f_games = filter(gameDAOFactory, [{"column": "id", "value": 1, "op": "="}])
+            assert f_games == [loaded] and f_games[0] is loaded, (loaded, f_games)
+            print(loaded)
+
     if PZ1:
         all_games = get_all(gameDAOFactory)
         print(all_games)
@@ -1,12 +1,18 @@
 import os
 import sqlite3
+import time
+from contextlib import contextmanager
+
+from Contention import ContentionPolicy
+import Game
+import StatementCache
 
 
 CREATE_TABLES = ["""
 create table if not exists games (
     id integer primary key autoincrement,
     name text not null,
-    price real not null
+    price integer not null
 );""",
 """
 create table if not exists platforms (
@@ -41,7 +47,10 @@ create table if not exists roles (
     name text not null
 );""",
 '''
-insert into roles (name) values ("admin"), ("user");
+insert into roles (name) select "admin" where not exists (select 1 from roles where name = "admin");
+''',
+'''
+insert into roles (name) select "user" where not exists (select 1 from roles where name = "user");
 ''',
 """
 create table if not exists users (
@@ -53,11 +62,286 @@ create table if not exists users (
 );"""
 ]
 
+CREATE_SUMMARY_TABLES = ["""
+create index if not exists games_price_idx on games (price);""",
+"""
+create table if not exists game_price_stats (
+    id integer primary key check (id = 1),
+    game_count integer not null,
+    price_total integer not null
+);""",
+"""
+create table if not exists genre_game_counts (
+    genre_id integer primary key,
+    game_count integer not null
+);""",
+"""
+create table if not exists platform_game_counts (
+    platform_id integer primary key,
+    game_count integer not null
+);""",
+"""
+insert or ignore into game_price_stats (id, game_count, price_total)
+select 1, count(*), coalesce(sum(price), 0) from games;""",
+# link rows left behind by games deleted while foreign keys were off do not count
+"""
+insert or ignore into genre_game_counts (genre_id, game_count)
+select genre_id, count(*) from game_genres join games on games.id = game_genres.game_id group by genre_id;""",
+"""
+insert or ignore into platform_game_counts (platform_id, game_count)
+select platform_id, count(*) from game_platforms join games on games.id = game_platforms.game_id
+group by platform_id;""",
+"""
+create trigger if not exists games_stats_insert after insert on games begin
+    update game_price_stats set game_count = game_count + 1, price_total = price_total + new.price where id = 1;
+end;""",
+"""
+create trigger if not exists games_stats_delete after delete on games begin
+    update game_price_stats set game_count = game_count - 1, price_total = price_total - old.price where id = 1;
+end;""",
+"""
+create trigger if not exists games_stats_update after update of price on games begin
+    update game_price_stats set price_total = price_total - old.price + new.price where id = 1;
+end;""",
+"""
+create trigger if not exists game_genres_count_insert after insert on game_genres begin
+    insert into genre_game_counts (genre_id, game_count) values (new.genre_id, 1)
+    on conflict (genre_id) do update set game_count = game_count + 1;
+end;""",
+"""
+create trigger if not exists game_genres_count_delete after delete on game_genres begin
+    update genre_game_counts set game_count = game_count - 1 where genre_id = old.genre_id;
+end;""",
+"""
+create trigger if not exists genres_count_delete after delete on genres begin
+    delete from genre_game_counts where genre_id = old.id;
+end;""",
+"""
+create trigger if not exists game_platforms_count_insert after insert on game_platforms begin
+    insert into platform_game_counts (platform_id, game_count) values (new.platform_id, 1)
+    on conflict (platform_id) do update set game_count = game_count + 1;
+end;""",
+"""
+create trigger if not exists game_platforms_count_delete after delete on game_platforms begin
+    update platform_game_counts set game_count = game_count - 1 where platform_id = old.platform_id;
+end;""",
+"""
+create trigger if not exists platforms_count_delete after delete on platforms begin
+    delete from platform_game_counts where platform_id = old.id;
+end;"""
+]
+
+CREATE_SEARCH_TABLES = ["""
+create virtual table if not exists games_fts using fts5(
+    name,
+    content='games',
+    content_rowid='id'
+);""",
+"""
+create trigger if not exists games_fts_insert after insert on games begin
+    insert into games_fts (rowid, name) values (new.id, new.name);
+end;""",
+"""
+create trigger if not exists games_fts_delete after delete on games begin
+    insert into games_fts (games_fts, rowid, name) values ('delete', old.id, old.name);
+end;""",
+"""
+create trigger if not exists games_fts_update after update of name on games begin
+    insert into games_fts (games_fts, rowid, name) values ('delete', old.id, old.name);
+    insert into games_fts (rowid, name) values (new.id, new.name);
+end;"""
+]
+
+
+def listing_names(reference: str, game_id: str) -> str:
+    # names of a game's platforms or genres as a sorted json array
+    table = f"{reference}s"
+    link_table = f"game_{reference}s"
+    return f"""(select json_group_array(name) from (
+        select {table}.name from {link_table} join {table} on {table}.id = {link_table}.{reference}_id
+        where {link_table}.game_id = {game_id} order by {table}.name))"""
+
+
+def listing_triggers(reference: str) -> list:
+    table = f"{reference}s"
+    link_table = f"game_{reference}s"
+    listings = f"{reference}_listings"
+    return [f"""
+create trigger if not exists {link_table}_listing_insert after insert on {link_table} begin
+    insert or ignore into {listings} ({reference}_id, {reference}, id, name, price)
+    select {table}.id, {table}.name, games.id, games.name, games.price from {table}, games
+    where {table}.id = new.{reference}_id and games.id = new.game_id;
+    update game_listings set {table} = {listing_names(reference, "new.game_id")} where id = new.game_id;
+end;""",
+f"""
+create trigger if not exists {link_table}_listing_delete after delete on {link_table} begin
+    delete from {listings} where {reference}_id = old.{reference}_id and id = old.game_id;
+    update game_listings set {table} = {listing_names(reference, "old.game_id")} where id = old.game_id;
+end;""",
+f"""
+create trigger if not exists {table}_listing_update after update of name on {table} begin
+    update {listings} set {reference} = new.name where {reference}_id = new.id;
+    update game_listings set {table} = {listing_names(reference, "game_listings.id")}
+    where id in (select game_id from {link_table} where {reference}_id = new.id);
+end;"""]
+
+
+# denormalized read models for listing pages; link and rename triggers touch only the affected rows
+CREATE_LISTING_TABLES = ["""
+create table if not exists game_listings (
+    id integer primary key,
+    name text not null,
+    price integer not null,
+    platforms text not null default '[]',
+    genres text not null default '[]'
+);""",
+"""
+create index if not exists game_listings_price_idx on game_listings (price);""",
+"""
+create index if not exists game_listings_name_idx on game_listings (name);""",
+"""
+create table if not exists platform_listings (
+    platform_id integer not null,
+    platform text not null,
+    id integer not null,
+    name text not null,
+    price integer not null,
+    primary key (platform_id, id)
+);""",
+"""
+create index if not exists platform_listings_platform_idx on platform_listings (platform, price);""",
+"""
+create table if not exists genre_listings (
+    genre_id integer not null,
+    genre text not null,
+    id integer not null,
+    name text not null,
+    price integer not null,
+    primary key (genre_id, id)
+);""",
+"""
+create index if not exists genre_listings_genre_idx on genre_listings (genre, price);""",
+"""
+create trigger if not exists games_listing_insert after insert on games begin
+    insert into game_listings (id, name, price) values (new.id, new.name, new.price);
+end;""",
+"""
+create trigger if not exists games_listing_update after update of name, price on games begin
+    update game_listings set name = new.name, price = new.price where id = new.id;
+    update platform_listings set name = new.name, price = new.price where id = new.id;
+    update genre_listings set name = new.name, price = new.price where id = new.id;
+end;""",
+"""
+create trigger if not exists games_listing_delete after delete on games begin
+    delete from game_listings where id = old.id;
+end;"""
+] + listing_triggers("platform") + listing_triggers("genre")
+
+
+
+def listing_fill(reference: str) -> str:
+    table = f"{reference}s"
+    link_table = f"game_{reference}s"
+    return f"""
+insert or ignore into {reference}_listings ({reference}_id, {reference}, id, name, price)
+select {table}.id, {table}.name, games.id, games.name, games.price from {link_table}
+join {table} on {table}.id = {link_table}.{reference}_id
+join games on games.id = {link_table}.game_id;"""
+
+
+# back-fills the listing tables from games that existed before them, run only when they are created
+FILL_LISTING_TABLES = [f"""
+insert or ignore into game_listings (id, name, price, platforms, genres)
+select id, name, price, {listing_names("platform", "games.id")}, {listing_names("genre", "games.id")} from games;""",
+listing_fill("platform"),
+listing_fill("genre")]
+
+# table -> (row id expression, columns carried in the change payload)
+CHANGELOG_SOURCES = {
+    "games": ("id", ("id", "name", "price")),
+    "platforms": ("id", ("id", "name")),
+    "genres": ("id", ("id", "name")),
+    "game_platforms": ("game_id", ("game_id", "platform_id")),
+    "game_genres": ("game_id", ("game_id", "genre_id"))
+}
+
+
+def changelog_trigger(table: str, operation: str) -> str:
+    key, columns = CHANGELOG_SOURCES[table]
+    row = "old" if operation == "delete" else "new"
+    payload = ", ".join(f"'{column}', {row}.{column}" for column in columns)
+    return f"""
+create trigger if not exists {table}_changelog_{operation} after {operation} on {table} begin
+    insert into changelog (table_name, operation, row_id, data)
+    values ('{table}', '{operation}', {row}.{key}, json_object({payload}));
+end;"""
+
+
+CREATE_CHANGELOG_TABLES = ["""
+create table if not exists changelog (
+    seq integer primary key autoincrement,
+    table_name text not null,
+    operation text not null,
+    row_id integer not null,
+    data text not null,
+    created_at real not null default ((julianday('now') - 2440587.5) * 86400.0)
+);""",
+"""
+create table if not exists changelog_consumers (
+    name text primary key,
+    position integer not null
+);"""
+] + [changelog_trigger(table, operation)
+     for table in CHANGELOG_SOURCES
+     for operation in ("insert", "update", "delete")
+     if not (operation == "update" and table.startswith("game_"))]
+
+PROFILE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "query_only")
+
+PROFILES = {
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -16000,
+        "mmap_size": 0,
+        "temp_store": "default",
+        "query_only": "off"
+    },
+    "balanced": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+        "query_only": "off"
+    },
+    # journal mode is left alone so the switch works while other connections are open
+    "bulk-load": {
+        "synchronous": "off",
+        "cache_size": -262144,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+        "query_only": "off"
+    },
+    "read-only-analytics": {
+        "synchronous": "normal",
+        "cache_size": -262144,
+        "mmap_size": 1073741824,
+        "temp_store": "memory",
+        "query_only": "on"
+    }
+}
+
 
 class DataBaseConnection(object):
     __instance = None
     connection = None
     db_file_path: str = None
+    instrumentation = None
+    diagnostics = None
+    contention: ContentionPolicy = ContentionPolicy()
+    profile: str = None
+    replica = None
 
     def __init__(self):
         pass
@@ -69,7 +353,14 @@ class DataBaseConnection(object):
         return cls.__instance.connection
 
     @classmethod
-    def open_connection(cls, db_file_path: str, reinit_file: bool = False):
+    def get_read_connection(cls):
+        # catalog reads are served from the in-memory replica when one is attached
+        if cls.replica:
+            return cls.replica.get_connection()
+        return cls.get_connection()
+
+    @classmethod
+    def open_connection(cls, db_file_path: str, reinit_file: bool = False, profile: str = None):
         if cls.__instance.connection:
             # close previous connection
             raise ConnectionError("Close previous connection.")
@@ -80,9 +371,47 @@ class DataBaseConnection(object):
             if os.path.exists(db_file_path):
                 os.remove(db_file_path)
 
-        cls.__instance.connection = sqlite3.connect(db_file_path)
+        cls.__instance.connection = cls.connect(db_file_path, profile)
+        cls.profile = profile
+        cls._install_trace()
         return cls.__instance.connection
 
+    @classmethod
+    def connect(cls, db_file_path: str, profile: str = None, **kwargs) -> sqlite3.Connection:
+        # every connection to the catalog, shared or dedicated, is configured here
+        if cls.contention:
+            kwargs = dict(cls.contention.connect_kwargs(), **kwargs)
+        # room for every cached filter shape plus the fixed statements
+        kwargs.setdefault("cached_statements", StatementCache.shape_cache.max_shapes + StatementCache.FIXED_STATEMENTS)
+        connection = sqlite3.connect(db_file_path, **kwargs)
+        # link rows rely on "on delete cascade"
+        connection.execute("pragma foreign_keys = on")
+        if profile:
+            apply_pragmas(connection, profile_pragmas(profile))
+        return connection
+
+    @classmethod
+    def apply_profile(cls, profile: str):
+        apply_pragmas(cls.get_connection(), profile_pragmas(profile))
+        cls.profile = profile
+
+    @classmethod
+    @contextmanager
+    def use_profile(cls, profile: str):
+        # e.g. "bulk-load" for the duration of an import, then back to the exact previous settings
+        previous_profile = cls.profile
+        previous = read_pragmas(cls.get_connection())
+        cls.apply_profile(profile)
+        try:
+            yield cls.get_connection()
+        finally:
+            apply_pragmas(cls.get_connection(), previous)
+            cls.profile = previous_profile
+
+    @classmethod
+    def active_settings(cls) -> dict:
+        return dict(read_pragmas(cls.get_connection()), profile=cls.profile)
+
     @classmethod
     def close_connection(cls):
         if cls.__instance.connection:
@@ -93,6 +422,49 @@ class DataBaseConnection(object):
             finally:
                 cls.__instance.connection = None
 
+    @classmethod
+    def backup(cls, target_path: str, pages: int = 1024, sleep: float = 0.01,
+               connection: sqlite3.Connection = None) -> dict:
+        return backup_database(connection or cls.get_connection(), target_path, pages, sleep)
+
+    @classmethod
+    def set_contention(cls, contention: ContentionPolicy = None):
+        # applies to connections opened afterwards
+        cls.contention = contention
+
+    @classmethod
+    def set_replica(cls, replica=None):
+        cls.replica = replica
+        cls._install_trace()
+
+    @classmethod
+    def set_instrumentation(cls, instrumentation=None):
+        cls.instrumentation = instrumentation
+        cls._install_trace()
+
+    @classmethod
+    def set_diagnostics(cls, diagnostics=None):
+        cls.diagnostics = diagnostics
+        cls._install_trace()
+
+    @classmethod
+    def _trace(cls, statement: str):
+        if cls.diagnostics and cls.diagnostics.is_analyzing():
+            # plan capture is not application traffic
+            return
+        if cls.instrumentation:
+            cls.instrumentation.on_statement(statement)
+        if cls.diagnostics:
+            cls.diagnostics.on_statement(statement)
+
+    @classmethod
+    def _install_trace(cls):
+        if cls.__instance and cls.__instance.connection:
+            tracing = cls.instrumentation or cls.diagnostics
+            cls.__instance.connection.set_trace_callback(cls._trace if tracing else None)
+            if cls.replica:
+                cls.replica.connection.set_trace_callback(cls._trace if tracing else None)
+
     @classmethod
     def get_instance(cls):
         if not cls.__instance:
@@ -101,12 +473,162 @@ class DataBaseConnection(object):
 
     @classmethod
     def init_tables(cls):
-        con = cls.get_connection()
+        init_schema(cls.get_connection())
+
+
+# derived from games.price, rebuilt by init_schema after a price migration
+PRICE_DERIVED_TABLES = ("game_price_stats", "game_listings", "platform_listings", "genre_listings")
+
+
+def migrate_price_storage(con: sqlite3.Connection) -> int:
+    # rewrites a games table with real prices into integer minor units; returns the number of games converted
+    column = con.execute("""select type from pragma_table_info('games') where name = 'price'""").fetchone()
+    if not column or column[0].lower() != "real":
+        return 0
+    scale = 10 ** Game.currency_exponent(Game.DEFAULT_CURRENCY)
+    # the column type only changes by rebuilding the table; link rows must not cascade meanwhile
+    con.execute("""pragma foreign_keys = off""")
+    # triggers on the link tables name games, which does not exist between the drop and the rename
+    con.execute("""pragma legacy_alter_table = on""")
+    try:
         with con:
-            for statement in CREATE_TABLES:
+            con.execute("""begin immediate""")
+            sequence = con.execute("""select seq from sqlite_sequence where name = 'games'""").fetchone()
+            con.execute("""
+                create table games_minor (
+                    id integer primary key autoincrement,
+                    name text not null,
+                    price integer not null
+                )""")
+            migrated = con.execute(f"""insert into games_minor (id, name, price)
+                select id, name, cast(round(price * {scale}) as integer) from games""").rowcount
+            # dropping games also drops its triggers and index, init_schema recreates them
+            con.execute("""drop table games""")
+            con.execute("""alter table games_minor rename to games""")
+            if sequence:
+                # ids of games deleted before the migration are still never reused
+                con.execute("""update sqlite_sequence set seq = max(seq, ?) where name = 'games'""", sequence)
+            for table in PRICE_DERIVED_TABLES:
+                con.execute(f"""drop table if exists {table}""")
+    finally:
+        con.execute("""pragma legacy_alter_table = off""")
+        con.execute("""pragma foreign_keys = on""")
+    return migrated
+
+
+def init_schema(con: sqlite3.Connection):
+    migrate_price_storage(con)
+    if not con.execute("""select 1 from sqlite_master""").fetchone():
+        # only takes effect before the first table exists; lets maintenance hand free pages back to the OS
+        con.execute("""pragma auto_vacuum = incremental""")
+        if con.execute("""pragma auto_vacuum""").fetchone()[0] != 2:
+            # already in wal mode, the switch needs a vacuum, which is instant on an empty file
+            con.execute("""vacuum""")
+    with con:
+        fts_exists = con.execute("""select 1 from sqlite_master where name = 'games_fts'""").fetchone()
+        listings_exist = con.execute("""select 1 from sqlite_master where name = 'game_listings'""").fetchone()
+        for statement in (CREATE_TABLES + CREATE_SUMMARY_TABLES + CREATE_SEARCH_TABLES + CREATE_LISTING_TABLES
+                          + CREATE_CHANGELOG_TABLES):
+            con.execute(statement)
+        if not fts_exists:
+            # index games that existed before the search table
+            con.execute("""insert into games_fts (games_fts) values ('rebuild')""")
+        if not listings_exist:
+            for statement in FILL_LISTING_TABLES:
                 con.execute(statement)
 
 
+class _BackupRestarted(Exception):
+    pass
+
+
+def backup_database(source: sqlite3.Connection, target_path: str, pages: int = 1024, sleep: float = 0.01,
+                    max_restarts: int = 3) -> dict:
+    # online backup: copies `pages` pages per step and sleeps in between so writers get the lock;
+    # the copy lands under a temporary name and only replaces target_path once complete
+    if os.path.exists(target_path):
+        raise FileExistsError(target_path)
+    partial_path = target_path + ".partial"
+    progress = {"steps": 0, "pages": 0, "restarts": 0, "remaining": None}
+
+    def on_progress(status, remaining, total):
+        progress["steps"] += 1
+        progress["pages"] = total
+        # a write through another connection makes sqlite start the copy over
+        if progress["remaining"] is not None and remaining > progress["remaining"]:
+            progress["restarts"] += 1
+            if progress["restarts"] > max_restarts:
+                raise _BackupRestarted()
+        progress["remaining"] = remaining
+
+    started = time.perf_counter()
+    target = sqlite3.connect(partial_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=on_progress, sleep=sleep)
+        except _BackupRestarted:
+            # under constant writes finish in one step; in WAL mode that still does not block writers
+            progress["remaining"] = None
+            source.backup(target, pages=-1, progress=on_progress)
+    finally:
+        target.close()
+    os.replace(partial_path, target_path)
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(target_path)
+    return {
+        "path": target_path,
+        "pages": progress["pages"],
+        "steps": progress["steps"],
+        "restarts": progress["restarts"],
+        "bytes": size,
+        "seconds": seconds,
+        "throughput": size / seconds if seconds > 0 else 0.
+    }
+
+
+def profile_pragmas(profile: str) -> dict:
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile: {profile}")
+    return PROFILES[profile]
+
+
+def apply_pragmas(connection: sqlite3.Connection, pragmas: dict):
+    for pragma, value in pragmas.items():
+        if pragma not in PROFILE_PRAGMAS:
+            raise ValueError(f"Unsupported pragma: {pragma}")
+        connection.execute(f"pragma {pragma} = {value}").fetchall()
+
+
+def read_pragmas(connection: sqlite3.Connection) -> dict:
+    return {pragma: connection.execute(f"pragma {pragma}").fetchone()[0] for pragma in PROFILE_PRAGMAS}
+
+
+class DedicatedConnection(object):
+    # stands in for DataBaseConnection where a thread or process needs its own connection
+    def __init__(self, db_file_path: str, profile: str = None, **kwargs):
+        self.db_file_path = db_file_path
+        self.contention = DataBaseConnection.contention
+        self.profile = profile
+        self.connection = DataBaseConnection.connect(db_file_path, profile, **kwargs)
+
+    def get_connection(self):
+        if not self.connection:
+            raise ValueError("No connection.")
+        return self.connection
+
+    def get_read_connection(self):
+        return self.get_connection()
+
+    def close_connection(self):
+        if self.connection:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            finally:
+                self.connection = None
+
+
 if __name__ == "__main__":
     instance = DataBaseConnection.get_instance()
     instance.open_connection("db.db")
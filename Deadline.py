@@ -0,0 +1,93 @@
+import functools
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# virtual machine instructions between deadline checks
+PROGRESS_STEPS = 1000
+
+_local = threading.local()
+# bounded calls running per connection; the progress handler belongs to the connection, which pool threads share
+_installed = dict()
+_installed_lock = threading.Lock()
+
+
+class QueryTimeout(TimeoutError):
+    pass
+
+
+def _deadlines() -> list:
+    if not hasattr(_local, "deadlines"):
+        _local.deadlines = list()
+    return _local.deadlines
+
+
+def _expired() -> bool:
+    deadlines = _deadlines()
+    return bool(deadlines) and time.perf_counter() >= min(deadlines)
+
+
+def remaining() -> float:
+    # seconds left on the tightest ambient deadline of this thread, None without one
+    deadlines = _deadlines()
+    return max(0., min(deadlines) - time.perf_counter()) if deadlines else None
+
+
+@contextmanager
+def within(seconds: float = None):
+    # ambient deadline for every bounded DAO read made inside the block on this thread
+    if seconds is None:
+        yield
+        return
+    deadlines = _deadlines()
+    deadlines.append(time.perf_counter() + seconds)
+    try:
+        yield
+    finally:
+        deadlines.pop()
+
+
+def _install(connections: list):
+    with _installed_lock:
+        for con in connections:
+            if not _installed.get(con):
+                # sqlite aborts the running statement with SQLITE_INTERRUPT once this returns true;
+                # the handler reads the deadlines of whichever thread is running the statement
+                con.set_progress_handler(_expired, PROGRESS_STEPS)
+            _installed[con] = _installed.get(con, 0) + 1
+
+
+def _uninstall(connections: list):
+    with _installed_lock:
+        for con in connections:
+            _installed[con] -= 1
+            if not _installed[con]:
+                del _installed[con]
+                con.set_progress_handler(None, PROGRESS_STEPS)
+
+
+def bounded(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, timeout: float = None, **kwargs):
+        deadlines = _deadlines()
+        if timeout is None and not deadlines:
+            return method(self, *args, **kwargs)
+
+        name = f"{type(self).__name__}.{method.__name__}"
+        with within(timeout):
+            if _expired():
+                raise QueryTimeout(f"{name} deadline passed before the query started.")
+            # reads may be served by a replica connection rather than the primary
+            connections = list(dict.fromkeys((self._dbcon.get_connection(), self._dbcon.get_read_connection())))
+            _install(connections)
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if _expired():
+                    raise QueryTimeout(f"{name} exceeded its deadline and was cancelled.") from e
+                raise
+            finally:
+                _uninstall(connections)
+    return wrapper
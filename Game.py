@@ -1,10 +1,70 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+
+# digits after the decimal point of the minor unit, per ISO 4217
+CURRENCY_EXPONENTS = {
+    "USD": 2,
+    "EUR": 2,
+    "GBP": 2,
+    "JPY": 0,
+    "KWD": 3
+}
+# the catalog stores every price as an integer count of this currency's minor unit
+DEFAULT_CURRENCY = "USD"
+# largest distance from a whole minor unit still read as float noise
+FLOAT_NOISE = Decimal("1e-6")
+
+
+def currency_exponent(currency: str) -> int:
+    if currency not in CURRENCY_EXPONENTS:
+        raise ValueError(f"Unknown currency: {currency}")
+    return CURRENCY_EXPONENTS[currency]
+
+
+def to_minor(price, currency: str = DEFAULT_CURRENCY, rounding: str = ROUND_HALF_UP) -> int:
+    # str() first, so a float like 0.1 is read as the 0.1 it prints as, not its binary approximation
+    try:
+        amount = Decimal(str(price).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid price: {price!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid price: {price!r}")
+    return int(amount.scaleb(currency_exponent(currency)).quantize(Decimal(1), rounding=rounding))
+
+
+def is_whole_minor(price, currency: str = DEFAULT_CURRENCY) -> bool:
+    # binary noise of a float, like 0.1 + 0.2, is far below any minor unit and does not count as extra precision
+    amount = Decimal(str(price).strip()).scaleb(currency_exponent(currency))
+    return abs(amount - amount.to_integral_value()) <= (FLOAT_NOISE if isinstance(price, float) else 0)
+
+
+def from_minor(minor: int, currency: str = DEFAULT_CURRENCY) -> Decimal:
+    exponent = currency_exponent(currency)
+    return (Decimal(minor) / 10 ** exponent).quantize(Decimal(10) ** -exponent)
+
+
+def priced(rows: list, column: int = 2) -> list:
+    # games rows as read from sqlite carry minor units, callers get the price in currency units
+    return [row[:column] + (from_minor(row[column]),) + row[column + 1:] for row in rows]
+
+
 class Game:
-    def __init__(self, name: str = "", price: float = .0, platform_ids: set = set(), genre_ids: set = set()):
+    def __init__(self, name: str = "", price=.0, platform_ids: set = set(), genre_ids: set = set(),
+                 currency: str = DEFAULT_CURRENCY):
         self.name: str = name
-        self.price: float = price
+        self.currency: str = currency
+        self.price_minor: int = to_minor(price, currency)
         self.platform_ids: set = platform_ids
         self.genre_ids: set = genre_ids
 
+    @property
+    def price(self) -> Decimal:
+        return from_minor(self.price_minor, self.currency)
+
+    @price.setter
+    def price(self, price):
+        self.price_minor = to_minor(price, self.currency)
+
 
 class GameBuilder:
     def __init__(self):
@@ -20,7 +80,7 @@ class GameBuilder:
     def set_name(self, name: str = ""):
         self.game.name = name
 
-    def set_price(self, price: float = .0):
+    def set_price(self, price=.0):
         self.game.price = price
 
     def add_platform_ids(self, platform_ids: list):
@@ -0,0 +1,147 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from DataBaseConnection import DataBaseConnection, PROFILES
+import CatalogIO
+
+
+MAX_KEPT_ERRORS = 100
+
+# reference snapshot installed in every worker process by _init_worker
+_platforms: dict = None
+_genres: dict = None
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = 0
+        self.seconds = 0.
+
+    @property
+    def throughput(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.
+
+    def add(self, rows: int, seconds: float):
+        self.rows += rows
+        self.seconds += seconds
+
+    def __repr__(self):
+        return f"{self.name}: {self.rows} rows, {self.seconds:.2f}s, {self.throughput:.0f} rows/s"
+
+
+class IngestStats:
+    def __init__(self):
+        self.read = StageStats("read")
+        self.parse = StageStats("parse")
+        self.write = StageStats("write")
+        self.rejected = 0
+        self.errors = list()
+        self.backpressure_waits = 0
+        self._started = time.perf_counter()
+        self.elapsed = 0.
+
+    @property
+    def throughput(self) -> float:
+        return self.write.rows / self.elapsed if self.elapsed > 0 else 0.
+
+    def reject(self, errors: list):
+        self.rejected += len(errors)
+        self.errors.extend(errors[:MAX_KEPT_ERRORS - len(self.errors)])
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._started
+
+    def report(self, out=print):
+        for stage in (self.read, self.parse, self.write):
+            out(stage)
+        out(f"total: {self.write.rows} rows written, {self.rejected} rejected, "
+            f"{self.elapsed:.2f}s, {self.throughput:.0f} rows/s, {self.backpressure_waits} backpressure waits")
+
+
+def _init_worker(platforms: dict, genres: dict):
+    global _platforms, _genres
+    _platforms = platforms
+    _genres = genres
+
+
+def normalize_chunk(records: list) -> tuple:
+    started = time.perf_counter()
+    games = list()
+    errors = list()
+    for record in records:
+        try:
+            games.append(CatalogIO.resolve_game(CatalogIO.parse_game(record), _platforms, _genres))
+        except Exception as e:
+            errors.append((record, str(e)))
+    return games, errors, time.perf_counter() - started
+
+
+def read_chunks(path: str, fmt: str, chunk_size: int, stats: IngestStats):
+    records = CatalogIO.read_records(path, fmt)
+    while True:
+        started = time.perf_counter()
+        chunk = next(CatalogIO.batched(records, chunk_size), None)
+        if chunk is None:
+            return
+        stats.read.add(len(chunk), time.perf_counter() - started)
+        yield chunk
+
+
+def ingest_games(dbcon: DataBaseConnection, path: str, fmt: str = None, chunk_size: int = 5000,
+                 workers: int = None, max_in_flight: int = None, progress: CatalogIO.Progress = None) -> IngestStats:
+    con = dbcon.get_connection()
+    workers = workers or os.cpu_count() or 1
+    # bounded number of parsed-but-unwritten chunks: readers and parsers wait for the writer
+    max_in_flight = max_in_flight or workers * 2
+    platforms = CatalogIO.name_index(con, "platforms")
+    genres = CatalogIO.name_index(con, "genres")
+    progress = progress or CatalogIO.Progress("games")
+    stats = IngestStats()
+    in_flight = deque()
+
+    def drain_one():
+        games, errors, parse_seconds = in_flight.popleft().result()
+        stats.parse.add(len(games) + len(errors), parse_seconds)
+        stats.reject(errors)
+        started = time.perf_counter()
+        CatalogIO.write_resolved_games(con, games)
+        stats.write.add(len(games), time.perf_counter() - started)
+        progress.update(len(games))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(platforms, genres)) as pool:
+        for chunk in read_chunks(path, fmt, chunk_size, stats):
+            if len(in_flight) >= max_in_flight:
+                stats.backpressure_waits += 1
+                drain_one()
+            in_flight.append(pool.submit(normalize_chunk, chunk))
+        while in_flight:
+            drain_one()
+
+    stats.finish()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse a games feed in parallel and load it through a single writer.")
+    parser.add_argument("path")
+    parser.add_argument("--db", default="db.db")
+    parser.add_argument("--profile", choices=list(PROFILES), default="balanced",
+                        help="profile for the connection; the load switches to bulk-load while it runs")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-in-flight", type=int)
+    args = parser.parse_args()
+
+    dbcon = DataBaseConnection.get_instance()
+    dbcon.open_connection(args.db, profile=args.profile)
+    dbcon.init_tables()
+
+    with dbcon.use_profile("bulk-load"):
+        stats = ingest_games(dbcon, args.path, args.format, args.chunk_size, args.workers, args.max_in_flight)
+    stats.report()
+    dbcon.close_connection()
@@ -0,0 +1,176 @@
+from __future__ import annotations
+import bisect
+import functools
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+# upper bounds in seconds: 10us, 25us, 50us, 100us ... 50s
+BUCKETS = tuple(base * 10 ** exp for exp in range(-5, 2) for base in (1, 2.5, 5))
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max
+        }
+
+
+class MetricsSink(ABC):
+
+    @abstractmethod
+    def record_call(self, dao: str, method: str, seconds: float, rows: int, statements: int) -> None:
+        pass
+
+    def record_slow_call(self, entry: dict) -> None:
+        pass
+
+
+class InMemoryMetrics(MetricsSink):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = dict()
+
+    def record_call(self, dao: str, method: str, seconds: float, rows: int, statements: int) -> None:
+        with self._lock:
+            if (dao, method) not in self.calls:
+                self.calls[(dao, method)] = {
+                    "latency": LatencyHistogram(),
+                    "rows": 0,
+                    "statements": 0
+                }
+            metrics = self.calls[(dao, method)]
+            metrics["latency"].record(seconds)
+            metrics["rows"] += rows
+            metrics["statements"] += statements
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                f"{dao}.{method}": dict(metrics["latency"].to_dict(),
+                                        rows=metrics["rows"],
+                                        statements=metrics["statements"])
+                for (dao, method), metrics in self.calls.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self.calls = dict()
+
+
+class _Call:
+    def __init__(self, dao: str, method: str):
+        self.dao = dao
+        self.method = method
+        self.rows = 0
+        self.statements = list()
+        self.started = time.perf_counter()
+
+
+class Instrumentation:
+    def __init__(self, slow_threshold: float = 0.1, sinks: list = None, slow_log_size: int = 1000, out=print):
+        self.slow_threshold = slow_threshold
+        self.metrics = InMemoryMetrics()
+        self.sinks = [self.metrics] + list(sinks or [])
+        self.slow_log = deque(maxlen=slow_log_size)
+        self.unattributed_statements = 0
+        self._out = out
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = list()
+        return self._local.stack
+
+    def on_statement(self, statement: str):
+        # sqlite3 trace callback; trigger bodies are reported as "-- TRIGGER ..."
+        if statement.startswith("--"):
+            return
+        stack = self._stack()
+        if not stack:
+            with self._lock:
+                self.unattributed_statements += 1
+        for call in stack:
+            call.statements.append(statement)
+
+    def begin(self, dao: str, method: str) -> _Call:
+        call = _Call(dao, method)
+        self._stack().append(call)
+        return call
+
+    def end(self, call: _Call):
+        seconds = time.perf_counter() - call.started
+        self._stack().pop()
+        for sink in self.sinks:
+            sink.record_call(call.dao, call.method, seconds, call.rows, len(call.statements))
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            entry = {
+                "dao": call.dao,
+                "method": call.method,
+                "seconds": seconds,
+                "rows": call.rows,
+                "statements": list(call.statements)
+            }
+            self.slow_log.append(entry)
+            for sink in self.sinks:
+                sink.record_slow_call(entry)
+            if self._out:
+                self._out(f"slow call {call.dao}.{call.method}: {seconds * 1000:.1f}ms, "
+                          f"{call.rows} rows, {len(call.statements)} statements")
+
+    def snapshot(self) -> dict:
+        return self.metrics.snapshot()
+
+
+def instrumented(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = getattr(self._dbcon, "instrumentation", None)
+        diagnostics = getattr(self._dbcon, "diagnostics", None)
+        if instrumentation is None and diagnostics is None:
+            return method(self, *args, **kwargs)
+        call = instrumentation.begin(type(self).__name__, method.__name__) if instrumentation else None
+        try:
+            result = method(self, *args, **kwargs)
+            if call and isinstance(result, list):
+                call.rows = len(result)
+            return result
+        finally:
+            if call:
+                instrumentation.end(call)
+            if diagnostics:
+                # plans are captured after the call, never from inside the trace callback
+                diagnostics.analyze_pending(self._dbcon.get_connection())
+    return wrapper
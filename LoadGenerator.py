@@ -0,0 +1,257 @@
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+from multiprocessing import Pool
+
+from DataBaseConnection import DataBaseConnection, DedicatedConnection, PROFILES
+import Benchmark
+import DAOFactoryMethod
+import Game
+import User
+
+
+READ_OPERATIONS = ("filter_id", "filter_price", "search")
+WRITE_OPERATIONS = ("update_price",)
+ROLE_LOGINS = {
+    "admin": ("load-admin", "load-admin"),
+    "user": ("load-user", "load-user")
+}
+
+
+def is_busy(error: Exception) -> bool:
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+def seed_database(db_file_path: str, games: int, seed: int = 0):
+    dbcon = DataBaseConnection.get_instance()
+    dbcon.open_connection(db_file_path, reinit_file=True)
+    dbcon.init_tables()
+    Benchmark.build_catalog(dbcon, games, random.Random(seed))
+    DAOFactoryMethod.add(DAOFactoryMethod.UserDAOFactory(dbcon),
+                         [User.User(login, password, role) for role, (login, password) in ROLE_LOGINS.items()])
+    dbcon.close_connection()
+
+
+def missing_logins(db_file_path: str, roles: list) -> list:
+    dbcon = DedicatedConnection(db_file_path)
+    try:
+        users = DAOFactoryMethod.UserDAOFactory(dbcon).create_DAO()
+        return [ROLE_LOGINS[role][0] for role in roles
+                if not users.filter([{"column": "login", "value": ROLE_LOGINS[role][0], "op": "="}])]
+    finally:
+        dbcon.close_connection()
+
+
+def login(proxy: DAOFactoryMethod.DAOProxy, role: str):
+    # a refused login leaves the proxy answering None without touching sqlite, so it must not count as a session
+    if not proxy.login(*ROLE_LOGINS[role]):
+        raise PermissionError(f"Login as {ROLE_LOGINS[role][0]} refused.")
+
+
+class WorkerResult:
+    def __init__(self):
+        self.latencies = dict()
+        self.errors = dict()
+        self.busy = 0
+        self.retries = 0
+        self.denied = 0
+        self.policy = dict()
+
+    def record(self, operation: str, seconds: float):
+        self.latencies.setdefault(operation, list()).append(seconds)
+
+    def error(self, error: Exception):
+        name = type(error).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def merge(self, other: "WorkerResult"):
+        for operation, samples in other.latencies.items():
+            self.latencies.setdefault(operation, list()).extend(samples)
+        for name, count in other.errors.items():
+            self.errors[name] = self.errors.get(name, 0) + count
+        self.busy += other.busy
+        self.retries += other.retries
+        self.denied += other.denied
+        for key, value in other.policy.items():
+            self.policy[key] = self.policy.get(key, 0) + value
+
+
+def with_retries(call, result: WorkerResult, config: dict) -> bool:
+    for attempt in range(config["max_retries"] + 1):
+        try:
+            call()
+            return True
+        except PermissionError:
+            result.denied += 1
+            return False
+        except Exception as e:
+            if is_busy(e):
+                result.busy += 1
+                if attempt < config["max_retries"]:
+                    result.retries += 1
+                    time.sleep(config["retry_delay"] * (attempt + 1))
+                    continue
+            result.error(e)
+            return False
+
+
+def run_worker(config: dict) -> WorkerResult:
+    rng = random.Random(config["seed"])
+    policy_before = DataBaseConnection.contention.snapshot() if DataBaseConnection.contention else None
+    kwargs = {"timeout": config["timeout"]} if config["timeout"] is not None else {}
+    dbcon = DedicatedConnection(config["db_file_path"], config["profile"], **kwargs)
+    proxy = DAOFactoryMethod.DAOProxy(DAOFactoryMethod.GameDAOFactory(dbcon).create_DAO())
+    result = WorkerResult()
+    if not with_retries(lambda: login(proxy, config["role"]), result, config):
+        dbcon.close_connection()
+        return result
+    games = config["games"]
+
+    def operate(operation: str):
+        if operation == "filter_id":
+            proxy.filter([{"column": "id", "value": rng.randrange(1, games + 1), "op": "="}])
+        elif operation == "filter_price":
+            proxy.filter([{"column": "price", "value": rng.uniform(99, 100), "op": ">"}])
+        elif operation == "search":
+            proxy.search(f"game {rng.randrange(games)}", 10)
+        elif operation == "update_price":
+            found = proxy.filter([{"column": "id", "value": rng.randrange(1, games + 1), "op": "="}])
+            if found:
+                _, name, price = found[0]
+                proxy.update(Game.Game(name, price, set(), set()),
+                             Game.Game(name, round(rng.uniform(0, 100), 2), set(), set()))
+
+    interval = 1. / config["rate"] if config["rate"] else 0.
+    started = time.perf_counter()
+    deadline = started + config["duration"]
+    scheduled = started
+    while True:
+        if interval:
+            # open loop: latency counts from the scheduled arrival, so queueing shows up
+            scheduled += rng.expovariate(1. / interval)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            scheduled = time.perf_counter()
+        if scheduled >= deadline:
+            break
+
+        writes = config["role"] == "admin" and rng.random() < config["write_ratio"]
+        operation = rng.choice(WRITE_OPERATIONS if writes else READ_OPERATIONS)
+        if with_retries(lambda: operate(operation), result, config):
+            result.record(operation, time.perf_counter() - scheduled)
+
+    if policy_before is not None:
+        result.policy = policy_delta(policy_before, DataBaseConnection.contention.snapshot())
+    dbcon.close_connection()
+    return result
+
+
+def policy_delta(before: dict, after: dict) -> dict:
+    return {key: after[key] - before[key] for key in after}
+
+
+def run(db_file_path: str, games: int, admins: int = 1, users: int = 4, write_ratio: float = 0.2,
+        rate: float = 0., duration: float = 10., processes: bool = False, timeout: float = None,
+        max_retries: int = 3, retry_delay: float = 0.01, seed: int = 0, profile: str = None) -> dict:
+    workers = admins + users
+    missing = missing_logins(db_file_path, [role for role, count in (("admin", admins), ("user", users)) if count])
+    if missing:
+        raise ValueError(f"{db_file_path} has no load user {', '.join(missing)}, seed it first.")
+    configs = [{
+        "db_file_path": db_file_path,
+        "games": games,
+        "role": "admin" if i < admins else "user",
+        "write_ratio": write_ratio,
+        "rate": rate / workers if rate else 0.,
+        "duration": duration,
+        "timeout": timeout,
+        "max_retries": max_retries,
+        "retry_delay": retry_delay,
+        "profile": profile,
+        "seed": seed + i
+    } for i in range(workers)]
+
+    policy_before = DataBaseConnection.contention.snapshot() if DataBaseConnection.contention else None
+    started = time.perf_counter()
+    if processes:
+        with Pool(workers) as pool:
+            results = pool.map(run_worker, configs)
+    else:
+        results = [None] * workers
+
+        def target(i):
+            results[i] = run_worker(configs[i])
+
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = WorkerResult()
+    for result in results:
+        total.merge(result)
+    if not processes and policy_before is not None:
+        # threads share one policy, so per-worker deltas overlap
+        total.policy = policy_delta(policy_before, DataBaseConnection.contention.snapshot())
+    return summarize(total, elapsed)
+
+
+def summarize(result: WorkerResult, elapsed: float) -> dict:
+    def latency(samples: list) -> dict:
+        return {
+            "count": len(samples),
+            "throughput": len(samples) / elapsed if elapsed > 0 else 0.,
+            "p50": Benchmark.percentile(samples, 50),
+            "p90": Benchmark.percentile(samples, 90),
+            "p99": Benchmark.percentile(samples, 99),
+            "max": max(samples)
+        }
+
+    every = [sample for samples in result.latencies.values() for sample in samples]
+    return {
+        "elapsed": elapsed,
+        "total": latency(every) if every else {"count": 0},
+        "operations": {operation: latency(samples) for operation, samples in result.latencies.items()},
+        "busy_errors": result.busy,
+        "retries": result.retries,
+        "denied": result.denied,
+        "errors": result.errors,
+        "contention_policy": result.policy
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive concurrent DAOProxy sessions against one database file.")
+    parser.add_argument("--db", default="load.db")
+    parser.add_argument("--seed-games", type=int, help="recreate the database with this many synthetic games")
+    parser.add_argument("--games", type=int, default=10000, help="number of games the workers pick from")
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="share of admin operations that write")
+    parser.add_argument("--rate", type=float, default=0., help="total arrivals per second, 0 for closed loop")
+    parser.add_argument("--duration", type=float, default=10.)
+    parser.add_argument("--processes", action="store_true", help="one process per session instead of threads")
+    parser.add_argument("--timeout", type=float, help="busy timeout in seconds, defaults to the contention policy")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--profile", choices=list(PROFILES), help="performance profile for every session")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.seed_games:
+        seed_database(args.db, args.seed_games, args.seed)
+    games = args.seed_games or args.games
+
+    try:
+        report = run(args.db, games, args.admins, args.users, args.write_ratio, args.rate, args.duration,
+                     args.processes, args.timeout, args.max_retries, seed=args.seed, profile=args.profile)
+    except ValueError as e:
+        parser.error(f"{e} (use --seed-games)")
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,168 @@
+import argparse
+import sqlite3
+import threading
+import time
+
+from DataBaseConnection import DataBaseConnection
+
+
+# rows sampled per index by "pragma optimize", keeps ANALYZE cheap on large tables
+ANALYSIS_LIMIT = 1000
+# free pages handed back per incremental vacuum step, the budget is checked between steps
+VACUUM_STEP_PAGES = 256
+
+
+def enable_incremental_vacuum(con: sqlite3.Connection) -> bool:
+    # databases created before auto_vacuum was set need one full VACUUM to switch over
+    if con.execute("""pragma auto_vacuum""").fetchone()[0] == 2:
+        return False
+    con.execute("""pragma auto_vacuum = incremental""")
+    con.execute("""vacuum""")
+    return True
+
+
+class MaintenanceScheduler:
+    def __init__(self, db_file_path: str, interval: float = 300., idle: float = 5., budget: float = 1.,
+                 poll: float = 1., out=print):
+        self.db_file_path = db_file_path
+        self.interval = interval
+        self.idle = idle
+        self.budget = budget
+        self.poll = poll
+        self.history = list()
+        self._out = out
+        self._stop = threading.Event()
+        self._thread = None
+        self._data_version = None
+        self._last_write = time.monotonic()
+        self._last_run = 0.
+
+    def run_once(self, budget: float = None, connection: sqlite3.Connection = None) -> dict:
+        budget = self.budget if budget is None else budget
+        con = connection or DataBaseConnection.connect(self.db_file_path)
+        deadline = time.perf_counter() + budget
+        # long statements are interrupted once the budget is spent
+        con.set_progress_handler(lambda: time.perf_counter() >= deadline, 1000)
+        started = time.perf_counter()
+        report = {"tasks": dict()}
+        try:
+            for name, task in (("optimize", self._optimize),
+                               ("incremental_vacuum", self._incremental_vacuum),
+                               ("checkpoint", self._checkpoint)):
+                if time.perf_counter() >= deadline:
+                    report["tasks"][name] = {"skipped": "budget"}
+                    continue
+                task_started = time.perf_counter()
+                try:
+                    result = task(con, deadline)
+                except sqlite3.OperationalError as e:
+                    result = {"error": str(e)}
+                result["seconds"] = time.perf_counter() - task_started
+                report["tasks"][name] = result
+        finally:
+            con.set_progress_handler(None, 1000)
+            if connection is None:
+                con.close()
+        report["seconds"] = time.perf_counter() - started
+        report["reclaimed_pages"] = report["tasks"].get("incremental_vacuum", dict()).get("reclaimed_pages", 0)
+        self.history.append(report)
+        self._last_run = time.monotonic()
+        if self._out:
+            self._out(f"maintenance: {report['reclaimed_pages']} pages reclaimed in {report['seconds']:.2f}s "
+                      + ", ".join(f"{name} {self._describe(result)}" for name, result in report["tasks"].items()))
+        return report
+
+    @staticmethod
+    def _describe(result: dict) -> str:
+        if "skipped" in result:
+            return f"skipped ({result['skipped']})"
+        if "error" in result:
+            return f"failed ({result['error']})"
+        return f"{result['seconds']:.2f}s"
+
+    @staticmethod
+    def _optimize(con: sqlite3.Connection, deadline: float) -> dict:
+        # re-analyzes only the tables whose statistics sqlite considers stale
+        con.execute(f"""pragma analysis_limit = {ANALYSIS_LIMIT}""")
+        con.execute("""pragma optimize""").fetchall()
+        return dict()
+
+    @staticmethod
+    def _incremental_vacuum(con: sqlite3.Connection, deadline: float) -> dict:
+        if con.execute("""pragma auto_vacuum""").fetchone()[0] != 2:
+            return {"skipped": "auto_vacuum is not incremental", "reclaimed_pages": 0}
+        free_before = free = con.execute("""pragma freelist_count""").fetchone()[0]
+        while free and time.perf_counter() < deadline:
+            con.execute(f"""pragma incremental_vacuum({VACUUM_STEP_PAGES})""").fetchall()
+            free = con.execute("""pragma freelist_count""").fetchone()[0]
+        return {
+            "free_pages": free,
+            "reclaimed_pages": free_before - free,
+            "page_size": con.execute("""pragma page_size""").fetchone()[0]
+        }
+
+    @staticmethod
+    def _checkpoint(con: sqlite3.Connection, deadline: float) -> dict:
+        if con.execute("""pragma journal_mode""").fetchone()[0] != "wal":
+            return {"skipped": "not in wal mode"}
+        # passive never waits for readers or writers, whatever is left goes next run
+        busy, log_frames, checkpointed = con.execute("""pragma wal_checkpoint(passive)""").fetchone()
+        return {
+            "busy": bool(busy),
+            "wal_frames": log_frames,
+            "checkpointed_frames": checkpointed
+        }
+
+    def is_idle(self, con: sqlite3.Connection) -> bool:
+        # data_version moves whenever another connection commits to the file
+        version = con.execute("""pragma data_version""").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._last_write = time.monotonic()
+        return time.monotonic() - self._last_write >= self.idle
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        # one connection watches for writes and runs the maintenance, a run waits for an idle window
+        con = DataBaseConnection.connect(self.db_file_path)
+        try:
+            while not self._stop.wait(self.poll):
+                if not self.is_idle(con) or time.monotonic() - self._last_run < self.interval:
+                    continue
+                try:
+                    self.run_once(connection=con)
+                except Exception as e:
+                    self._last_run = time.monotonic()
+                    if self._out:
+                        self._out(f"maintenance failed: {e}")
+        finally:
+            con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run catalog database maintenance once.")
+    parser.add_argument("--db", default="db.db")
+    parser.add_argument("--budget", type=float, default=5.)
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="switch an existing database to auto_vacuum=incremental (runs a full VACUUM)")
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        con = DataBaseConnection.connect(args.db)
+        try:
+            print("switched to incremental vacuum" if enable_incremental_vacuum(con) else "already incremental")
+        finally:
+            con.close()
+    MaintenanceScheduler(args.db, budget=args.budget).run_once()
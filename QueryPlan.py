@@ -0,0 +1,159 @@
+import re
+import sqlite3
+import threading
+import time
+
+
+EXPLAINABLE = ("select", "update", "delete", "with")
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+SPACE_PATTERN = re.compile(r"\s+")
+TABLE_PATTERN = re.compile(r"^(?:SCAN|SEARCH) (\w+)")
+
+
+def statement_shape(statement: str) -> str:
+    # trace callbacks see expanded SQL, so literals are folded back into placeholders
+    return SPACE_PATTERN.sub(" ", LITERAL_PATTERN.sub("?", statement)).strip()
+
+
+class QueryPlanDiagnostics:
+    def __init__(self, large_table_rows: int = 10000, size_ttl: float = 60., out=print):
+        self.large_table_rows = large_table_rows
+        self.size_ttl = size_ttl
+        self.shapes = dict()
+        self._pending = dict()
+        self._table_rows = None
+        self._sized_at = 0.
+        self._sized_changes = 0
+        self._analyzing = False
+        self._analyzer = None
+        self._lock = threading.Lock()
+        self._out = out
+
+    def on_statement(self, statement: str):
+        if self._analyzing or not statement.lstrip().lower().startswith(EXPLAINABLE):
+            return
+        shape = statement_shape(statement)
+        with self._lock:
+            if shape in self.shapes:
+                self.shapes[shape]["executions"] += 1
+            elif shape in self._pending:
+                self._pending[shape]["executions"] += 1
+            else:
+                self._pending[shape] = {"statement": statement, "executions": 1}
+
+    def analyze_pending(self, con: sqlite3.Connection):
+        with self._lock:
+            stale = self._sizes_stale(con)
+            if not (self._pending or stale) or self._analyzing:
+                return
+            pending = self._pending
+            self._pending = dict()
+            self._analyzing = True
+            self._analyzer = threading.get_ident()
+        try:
+            if stale:
+                self._read_table_sizes(con)
+                self._recheck(con)
+            for shape, seen in pending.items():
+                try:
+                    plan = [row[3] for row in con.execute("explain query plan " + seen["statement"])]
+                except sqlite3.Error:
+                    # e.g. a table created in a transaction the plan cannot see yet
+                    continue
+                entry = {
+                    "shape": shape,
+                    "executions": seen["executions"],
+                    "plan": plan,
+                    "warnings": self._warnings(con, plan)
+                }
+                with self._lock:
+                    self.shapes[shape] = entry
+                if entry["warnings"] and self._out:
+                    self._out(f"query plan warning: {shape}: {'; '.join(entry['warnings'])}")
+        finally:
+            self._analyzer = None
+            self._analyzing = False
+
+    def is_analyzing(self) -> bool:
+        # true on the thread running the diagnostics' own explain and sizing statements
+        return self._analyzer == threading.get_ident()
+
+    def refresh_table_sizes(self):
+        self._table_rows = None
+
+    def _sizes_stale(self, con: sqlite3.Connection) -> bool:
+        # sizes are re-read on a ttl, or sooner once this connection has written enough rows to move a table
+        # across large_table_rows
+        return (self._table_rows is None
+                or time.monotonic() - self._sized_at >= self.size_ttl
+                or con.total_changes - self._sized_changes >= max(1, self.large_table_rows // 10))
+
+    def _read_table_sizes(self, con: sqlite3.Connection):
+        tables = [name for (name,) in con.execute(
+            """select name from sqlite_master where type = 'table' and name not like 'sqlite_%'
+            and sql not like 'create virtual%'""")]
+        # max(rowid) is a single seek and close enough to the row count
+        self._table_rows = {
+            table: con.execute(f"""select coalesce(max(rowid), 0) from "{table}" """).fetchone()[0]
+            for table in tables
+            if not self._without_rowid(con, table)
+        }
+        self._sized_at = time.monotonic()
+        self._sized_changes = con.total_changes
+
+    def _recheck(self, con: sqlite3.Connection):
+        # shapes analyzed while their tables were small are warned about once the tables have grown
+        with self._lock:
+            entries = list(self.shapes.values())
+        for entry in entries:
+            warnings = self._warnings(con, entry["plan"])
+            if warnings == entry["warnings"]:
+                continue
+            # a table that only grew keeps its warning, just with a new row count
+            known = {warning.split(" (")[0] for warning in entry["warnings"]}
+            new = [warning for warning in warnings if warning.split(" (")[0] not in known]
+            with self._lock:
+                entry["warnings"] = warnings
+            if new and self._out:
+                self._out(f"query plan warning: {entry['shape']}: {'; '.join(new)}")
+
+    def _large_tables(self, con: sqlite3.Connection) -> dict:
+        if self._table_rows is None:
+            self._read_table_sizes(con)
+        return {table: rows for table, rows in self._table_rows.items() if rows >= self.large_table_rows}
+
+    @staticmethod
+    def _without_rowid(con: sqlite3.Connection, table: str) -> bool:
+        sql = con.execute("""select sql from sqlite_master where name = ?""", (table,)).fetchone()[0] or ""
+        return "without rowid" in sql.lower()
+
+    def _warnings(self, con: sqlite3.Connection, plan: list) -> list:
+        large = self._large_tables(con)
+        touched = set()
+        warnings = list()
+        for detail in plan:
+            match = TABLE_PATTERN.match(detail)
+            if match:
+                touched.add(match.group(1))
+            if detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail:
+                table = detail.split()[1]
+                if table in large:
+                    warnings.append(f"full scan of {table} ({large[table]} rows)")
+        for detail in plan:
+            if detail.startswith("USE TEMP B-TREE") and touched & set(large):
+                warnings.append(f"{detail.lower()} over {', '.join(sorted(touched & set(large)))}")
+        return warnings
+
+    def report(self) -> list:
+        with self._lock:
+            return sorted((dict(entry) for entry in self.shapes.values() if entry["warnings"]),
+                          key=lambda entry: entry["executions"], reverse=True)
+
+    def missing_indexes(self) -> dict:
+        # table -> shapes that scan it in full
+        missing = dict()
+        for entry in self.report():
+            for warning in entry["warnings"]:
+                if warning.startswith("full scan of "):
+                    missing.setdefault(warning.split()[3], list()).append(entry["shape"])
+        return missing
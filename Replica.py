@@ -0,0 +1,136 @@
+import sqlite3
+import time
+
+from DataBaseConnection import DataBaseConnection
+import ChangeLog
+
+
+# how a logged change is replayed; inserts and updates are upserts so replays are idempotent
+APPLY_STATEMENTS = {
+    ("games", "insert"): """insert into games (id, name, price) values (:id, :name, :price)
+        on conflict (id) do update set name = excluded.name, price = excluded.price""",
+    ("games", "update"): """insert into games (id, name, price) values (:id, :name, :price)
+        on conflict (id) do update set name = excluded.name, price = excluded.price""",
+    ("games", "delete"): """delete from games where id = :id""",
+    ("platforms", "insert"): """insert into platforms (id, name) values (:id, :name)
+        on conflict (id) do update set name = excluded.name""",
+    ("platforms", "update"): """insert into platforms (id, name) values (:id, :name)
+        on conflict (id) do update set name = excluded.name""",
+    ("platforms", "delete"): """delete from platforms where id = :id""",
+    ("genres", "insert"): """insert into genres (id, name) values (:id, :name)
+        on conflict (id) do update set name = excluded.name""",
+    ("genres", "update"): """insert into genres (id, name) values (:id, :name)
+        on conflict (id) do update set name = excluded.name""",
+    ("genres", "delete"): """delete from genres where id = :id""",
+    ("game_platforms", "insert"): """insert or ignore into game_platforms (game_id, platform_id)
+        values (:game_id, :platform_id)""",
+    ("game_platforms", "delete"): """delete from game_platforms
+        where game_id = :game_id and platform_id = :platform_id""",
+    ("game_genres", "insert"): """insert or ignore into game_genres (game_id, genre_id) values (:game_id, :genre_id)""",
+    ("game_genres", "delete"): """delete from game_genres where game_id = :game_id and genre_id = :genre_id"""
+}
+
+
+class ServingReplica:
+    # in-memory copy of the catalog that serves DAO reads; writes keep going to the file
+    def __init__(self, dbcon: DataBaseConnection, max_staleness: float = 1., batch_size: int = 1000):
+        self._dbcon = dbcon
+        self.max_staleness = max_staleness
+        self.batch_size = batch_size
+        self.connection = None
+        self.position = 0
+        self._seen_changes = None
+        self._seen_version = None
+        self._refreshed_at = 0.
+        self.stats = {
+            "load_seconds": 0.,
+            "loads": 0,
+            "refreshes": 0,
+            "applied": 0
+        }
+
+    def load(self) -> float:
+        started = time.perf_counter()
+        primary = self._dbcon.get_connection()
+        replica = DataBaseConnection.connect(":memory:")
+        primary.backup(replica)
+        with replica:
+            # the copy's own sequence is exactly the changelog position it reflects
+            row = replica.execute("""select seq from sqlite_sequence where name = 'changelog'""").fetchone()
+            triggers = replica.execute("""select name from sqlite_master
+                where type = 'trigger' and name like '%\\_changelog\\_%' escape '\\'""").fetchall()
+            for (trigger,) in triggers:
+                replica.execute(f"""drop trigger {trigger}""")
+            replica.execute("""delete from changelog""")
+        if self.connection:
+            self.connection.close()
+        self.connection = replica
+        self.position = row[0] if row else 0
+        self._seen_changes, self._seen_version = self._write_marks(primary)
+        self._refreshed_at = time.perf_counter()
+        self.stats["load_seconds"] = time.perf_counter() - started
+        self.stats["loads"] += 1
+        return self.stats["load_seconds"]
+
+    def get_connection(self) -> sqlite3.Connection:
+        if not self.connection:
+            raise ValueError("No replica loaded.")
+        primary = self._dbcon.get_connection()
+        # committed writes are visible to the next read (an open transaction could still roll back);
+        # max_staleness only bounds how long a missed write, e.g. from another process, can hide
+        if not primary.in_transaction and (self._write_marks(primary) != (self._seen_changes, self._seen_version)
+                                           or time.perf_counter() - self._refreshed_at >= self.max_staleness):
+            self.refresh()
+        return self.connection
+
+    @staticmethod
+    def _write_marks(primary: sqlite3.Connection) -> tuple:
+        # total_changes counts this connection's writes, data_version moves when any other connection commits
+        return primary.total_changes, primary.execute("""pragma data_version""").fetchone()[0]
+
+    def refresh(self) -> int:
+        primary = self._dbcon.get_connection()
+        self._seen_changes, self._seen_version = self._write_marks(primary)
+        self._refreshed_at = time.perf_counter()
+        self.stats["refreshes"] += 1
+        oldest = primary.execute("""select min(seq) from changelog""").fetchone()[0]
+        if ChangeLog.latest_sequence(self._dbcon) > self.position and (oldest is None or oldest > self.position + 1):
+            # entries we still needed were truncated away, start over from a fresh copy
+            self.load()
+            return 0
+        applied = 0
+        while True:
+            changes = ChangeLog.read_since(self._dbcon, self.position, self.batch_size)
+            if not changes:
+                break
+            with self.connection:
+                for change in changes:
+                    self.connection.execute(APPLY_STATEMENTS[change["table"], change["operation"]], change["data"])
+            self.position = changes[-1]["seq"]
+            applied += len(changes)
+        self.stats["applied"] += applied
+        return applied
+
+    def lag(self) -> dict:
+        primary = self._dbcon.get_connection()
+        row = primary.execute("""select created_at from changelog where seq > ? order by seq limit 1""",
+                              (self.position,)).fetchone()
+        return {
+            "changes": ChangeLog.latest_sequence(self._dbcon) - self.position,
+            "seconds": max(0., time.time() - row[0]) if row else 0.
+        }
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, position=self.position, lag=self.lag())
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+
+def serve_from_memory(dbcon: DataBaseConnection, max_staleness: float = 1.) -> ServingReplica:
+    replica = ServingReplica(dbcon, max_staleness)
+    replica.load()
+    dbcon.set_replica(replica)
+    return replica
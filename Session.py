@@ -0,0 +1,138 @@
+import functools
+import threading
+
+from DataBaseConnection import DataBaseConnection
+import Game
+
+
+# tables whose rows are keyed by their id column (the first one) in the identity map
+MAPPED_TABLES = ("games", "platforms", "genres")
+# rows loaded here are stored in the form the DAO reads return, so both paths share one instance
+ROW_FORMS = {
+    "games": Game.priced
+}
+
+_local = threading.local()
+
+
+class IdentityMap:
+    def __init__(self):
+        self._rows = dict()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0
+        }
+
+    def get(self, table: str, id_: int):
+        row = self._rows.get((table, id_))
+        if row is not None:
+            self.stats["hits"] += 1
+        return row
+
+    def merge(self, table: str, rows: list) -> list:
+        # a row already in the map wins, so every caller in the session shares one instance per id
+        merged = list()
+        for row in rows:
+            key = (table, row[0])
+            known = self._rows.get(key)
+            if known is None:
+                self._rows[key] = known = row
+                self.stats["misses"] += 1
+            elif known is not row:
+                self.stats["hits"] += 1
+            merged.append(known)
+        return merged
+
+    def clear(self):
+        self._rows.clear()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(self.stats, rows=len(self._rows), hit_rate=self.stats["hits"] / lookups if lookups else 0.)
+
+
+class Session:
+    # one unit of work, e.g. a request; rows are loaded once and shared until the session ends
+    def __init__(self, dbcon: DataBaseConnection):
+        self._dbcon = dbcon
+        self.identity_map = IdentityMap()
+        self._seen_changes = None
+
+    def __enter__(self):
+        if not hasattr(_local, "sessions"):
+            _local.sessions = list()
+        _local.sessions.append(self)
+        self._seen_changes = self._dbcon.get_connection().total_changes
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.sessions.remove(self)
+        self.identity_map.clear()
+        return False
+
+    def _check_writes(self):
+        # a write through this connection may have changed mapped rows, drop them rather than serve stale ones
+        changes = self._dbcon.get_connection().total_changes
+        if changes != self._seen_changes:
+            self._seen_changes = changes
+            if len(self.identity_map):
+                self.identity_map.clear()
+                self.identity_map.stats["invalidations"] += 1
+
+    def merge(self, table: str, rows: list) -> list:
+        self._check_writes()
+        return self.identity_map.merge(table, rows)
+
+    def get(self, table: str, id_: int):
+        return self.get_many(table, [id_]).get(id_)
+
+    def get_many(self, table: str, ids: list) -> dict:
+        if table not in MAPPED_TABLES:
+            raise ValueError(f"Table {table} is not identity mapped.")
+        self._check_writes()
+        found = dict()
+        missing = list()
+        for id_ in dict.fromkeys(ids):
+            row = self.identity_map.get(table, id_)
+            if row is not None:
+                found[id_] = row
+            else:
+                missing.append(id_)
+        if missing:
+            # only the ids not in the map reach sqlite, in one statement
+            con = self._dbcon.get_read_connection()
+            statement = f"""select * from {table} where id in ({", ".join("?" * len(missing))})"""
+            with con:
+                rows = con.execute(statement, missing).fetchall()
+            rows = ROW_FORMS.get(table, list)(rows)
+            # merge() counts the loaded rows as misses, ids with no row are counted here
+            self.identity_map.stats["misses"] += len(missing) - len(rows)
+            for row in self.identity_map.merge(table, rows):
+                found[row[0]] = row
+        return found
+
+    def snapshot(self) -> dict:
+        return self.identity_map.snapshot()
+
+
+def current() -> Session:
+    sessions = getattr(_local, "sessions", None)
+    return sessions[-1] if sessions else None
+
+
+def identity_mapped(table: str):
+    # rows returned by the decorated DAO read are swapped for the session's instances
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            rows = method(self, *args, **kwargs)
+            session = current()
+            if session is None or session._dbcon.get_connection() is not self._dbcon.get_connection():
+                return rows
+            return session.merge(table, rows)
+        return wrapper
+    return decorator
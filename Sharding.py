@@ -0,0 +1,279 @@
+import heapq
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice, zip_longest
+
+from DataBaseConnection import DedicatedConnection, init_schema
+from SubjectObserver import Observer
+from Deadline import remaining, within
+import DAOFactoryMethod
+import Game
+import Memento
+
+
+def shard_paths(db_file_path: str, shards: int) -> list:
+    stem, ext = os.path.splitext(db_file_path)
+    return [f"{stem}.shard{k}{ext or '.db'}" for k in range(shards)]
+
+
+def shard_id_expression(shard: int, shards: int) -> str:
+    # next id past the shard's autoincrement high-water mark with id % shards == shard,
+    # so the owning shard of any game follows from its id alone
+    return f"""(select s + ((({shard} - s) % {shards}) + {shards}) % {shards} from
+        (select coalesce((select seq from sqlite_sequence where name = 'games'), 0) + 1 as s))"""
+
+
+class ShardedConnection(object):
+    # games and their link rows are split across the shard files, reference tables are copied to every
+    # shard; users, roles and anything else that is not sharded lives on shard 0
+    def __init__(self, db_file_path: str, shards: int, profile: str = None, reinit_file: bool = False):
+        if shards < 1:
+            raise ValueError("Need at least one shard.")
+        self.db_file_path = db_file_path
+        self.paths = shard_paths(db_file_path, shards)
+        if reinit_file:
+            for path in self.paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        # fan-out reads run each shard's query on a pool thread
+        self.shards = [DedicatedConnection(path, profile, check_same_thread=False) for path in self.paths]
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="shard")
+
+    def __len__(self):
+        return len(self.shards)
+
+    def get_connection(self):
+        return self.shards[0].get_connection()
+
+    def get_read_connection(self):
+        return self.get_connection()
+
+    def shard_of(self, game_id: int) -> int:
+        return game_id % len(self.shards)
+
+    def shard_for(self, game: Game.Game) -> int:
+        # spreads new games evenly; crc32 is stable across processes, unlike hash()
+        return zlib.crc32(game.name.encode("utf-8")) % len(self.shards)
+
+    def fan_out(self, call, items: list) -> list:
+        # the caller's deadline is thread-local, so it is handed to every pool thread explicitly
+        timeout = remaining()
+
+        def run(item):
+            with within(timeout):
+                return call(item)
+        return list(self._executor.map(run, items))
+
+    def init_tables(self):
+        for shard in self.shards:
+            init_schema(shard.get_connection())
+
+    def close_connection(self):
+        self._executor.shutdown()
+        for shard in self.shards:
+            shard.close_connection()
+
+
+class ShardedGameDAO(DAOFactoryMethod.DAO):
+    def __init__(self, dbcon: ShardedConnection):
+        self._dbcon = dbcon
+        self._last_action = None
+        self._shards = list()
+        for k, shard in enumerate(dbcon.shards):
+            dao = DAOFactoryMethod.GameDAO(shard)
+            dao._id_expression = shard_id_expression(k, len(dbcon))
+            self._shards.append(dao)
+
+    def get_all(self) -> list:
+        return list(heapq.merge(*self._dbcon.fan_out(lambda dao: dao.get_all(), self._shards),
+                                key=lambda row: row[0]))
+
+    def filter(self, params: list) -> list:
+        if not any(params):
+            return self.get_all()
+        return list(heapq.merge(*self._dbcon.fan_out(lambda dao: dao.filter(params), self._shards),
+                                key=lambda row: row[0]))
+
+    def get(self, game_id: int) -> tuple:
+        # single-shard lookup, the id names its shard
+        rows = self._shards[self._dbcon.shard_of(game_id)].filter([{
+            "column": "id",
+            "value": game_id,
+            "op": "="
+        }])
+        return rows[0] if rows else None
+
+    def search(self, text: str, limit: int = 20) -> list:
+        # fts ranks are per shard, so the ranked lists are interleaved rather than re-sorted
+        ranked = self._dbcon.fan_out(lambda dao: dao.search(text, limit), self._shards)
+        return [row for row in chain.from_iterable(zip_longest(*ranked)) if row is not None][:limit]
+
+    def count_by_genre(self, params: list = None) -> list:
+        return self._merge_counts(self._dbcon.fan_out(lambda dao: dao.count_by_genre(params), self._shards))
+
+    def count_by_platform(self, params: list = None) -> list:
+        return self._merge_counts(self._dbcon.fan_out(lambda dao: dao.count_by_platform(params), self._shards))
+
+    def price_stats(self, params: list = None) -> dict:
+        # minor-unit totals are summed exactly and divided once, as on a single database
+        parts = [part for part in self._dbcon.fan_out(lambda dao: dao.price_totals(params), self._shards)
+                 if part[0]]
+        return DAOFactoryMethod.price_summary(
+            sum(part[0] for part in parts),
+            min((part[1] for part in parts), default=None),
+            max((part[2] for part in parts), default=None),
+            sum(part[3] for part in parts))
+
+    def catalog_summary(self, params: list = None) -> dict:
+        return {
+            "genres": self.count_by_genre(params),
+            "platforms": self.count_by_platform(params),
+            "price": self.price_stats(params)
+        }
+
+    def listings(self, params: list = None, limit: int = None) -> list:
+        return self._merge_by_price(self._dbcon.fan_out(lambda dao: dao.listings(params, limit), self._shards),
+                                    limit)
+
+    def listings_by_platform(self, platform: str, params: list = None, limit: int = None) -> list:
+        return self._merge_by_price(self._dbcon.fan_out(
+            lambda dao: dao.listings_by_platform(platform, params, limit), self._shards), limit)
+
+    def listings_by_genre(self, genre: str, params: list = None, limit: int = None) -> list:
+        return self._merge_by_price(self._dbcon.fan_out(
+            lambda dao: dao.listings_by_genre(genre, params, limit), self._shards), limit)
+
+    @staticmethod
+    def _merge_by_price(parts: list, limit: int = None) -> list:
+        # every shard returns its cheapest `limit` rows in price order, the overall cheapest are among them
+        return list(islice(heapq.merge(*parts, key=lambda row: row[2]), limit))
+
+    @staticmethod
+    def _merge_counts(parts: list) -> list:
+        # reference ids are the same on every shard
+        counts = dict()
+        for part in parts:
+            for id_, name, game_count in part:
+                counts[id_, name] = counts.get((id_, name), 0) + game_count
+        return [(id_, name, game_count) for (id_, name), game_count in counts.items()]
+
+    def add(self, game: Game.Game):
+        self._shards[self._dbcon.shard_for(game)].add(game)
+        self._last_action = {
+            "action": "add",
+            "object": game
+        }
+
+    def remove(self, object_):
+        for dao in self._owners(object_):
+            dao.remove(object_)
+        self._last_action = {
+            "action": "remove",
+            "object": object_
+        }
+
+    def update(self, object_old: Game.Game, object_new: Game.Game):
+        # rows keep their id, so they stay on their shard even when renamed
+        for dao in self._owners(object_old):
+            dao.update(object_old, object_new)
+        self._last_action = {
+            "action": "update",
+            "old": object_old,
+            "new": object_new
+        }
+
+    def _owners(self, object_) -> list:
+        # games are matched by name and price, so the match is found with a fan-out read and
+        # the write then goes only to the shards that hold a matching row
+        cond = [
+            {
+                "column": "name",
+                "value": object_.name,
+                "op": "="
+            },
+            {
+                "column": "price",
+                "value": object_.price,
+                "op": "="
+            }
+        ]
+        rows = self._dbcon.fan_out(lambda dao: dao.filter(cond), self._shards)
+        return [dao for dao, found in zip(self._shards, rows) if found]
+
+    def attach(self, observer: Observer) -> None:
+        # the shard DAOs notify, they share GameDAO's observer list
+        self._shards[0].attach(observer)
+
+    def detach(self, observer: Observer) -> None:
+        self._shards[0].detach(observer)
+
+    def save(self) -> Memento.Memento:
+        return Memento.GameDAOMemento(self._last_action)
+
+    def restore(self, memento: Memento.Memento):
+        self._last_action = memento.get_state()
+        if self._last_action["action"] == "update":
+            self.update(self._last_action["new"], self._last_action["old"])
+        else:
+            raise NotImplementedError
+
+
+class ReplicatedDAO(DAOFactoryMethod.DAO):
+    # reference rows are written to every shard in the same order, so their ids agree everywhere
+    def __init__(self, dbcon: ShardedConnection, dao_class):
+        self._dbcon = dbcon
+        self._shards = [dao_class(shard) for shard in dbcon.shards]
+
+    def get_all(self) -> list:
+        return self._shards[0].get_all()
+
+    def filter(self, params: list) -> list:
+        return self._shards[0].filter(params)
+
+    def add(self, object_):
+        for dao in self._shards:
+            dao.add(object_)
+
+    def remove(self, object_):
+        for dao in self._shards:
+            dao.remove(object_)
+
+    def update(self, object_old, object_new):
+        for dao in self._shards:
+            dao.update(object_old, object_new)
+
+    def attach(self, observer: Observer) -> None:
+        self._shards[0].attach(observer)
+
+    def detach(self, observer: Observer) -> None:
+        self._shards[0].detach(observer)
+
+
+class ShardedGameDAOFactory(DAOFactoryMethod.DAOFactory):
+    _observer: Observer = None
+
+    def __init__(self, dbcon: ShardedConnection, observer=None):
+        self._dbcon = dbcon
+        self._observer = observer
+
+    def create_DAO(self) -> DAOFactoryMethod.DAO:
+        dao = ShardedGameDAO(self._dbcon)
+        if self._observer:
+            dao.attach(self._observer)
+        return dao
+
+
+class ReplicatedDAOFactory(DAOFactoryMethod.DAOFactory):
+    _observer: Observer = None
+
+    def __init__(self, dbcon: ShardedConnection, dao_class, observer=None):
+        self._dbcon = dbcon
+        self._dao_class = dao_class
+        self._observer = observer
+
+    def create_DAO(self) -> DAOFactoryMethod.DAO:
+        dao = ReplicatedDAO(self._dbcon, self._dao_class)
+        if self._observer:
+            dao.attach(self._observer)
+        return dao
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+
+MAX_SHAPES = 256
+# fixed statements (inserts, updates, lookups) that share sqlite3's cache with the filter shapes
+FIXED_STATEMENTS = 64
+
+
+class StatementShapeCache:
+    def __init__(self, max_shapes: int = MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self._shapes = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0
+        }
+
+    def build(self, template: str, params: list, qualifier: str = "") -> tuple:
+        # template holds a {where} slot; the result is the SQL text and its positional values
+        key = (template, qualifier, tuple((param["column"], param["op"]) for param in params))
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is not None:
+                self._shapes.move_to_end(key)
+                self.stats["hits"] += 1
+            else:
+                entry = self._compile(template, params, qualifier)
+                self._shapes[key] = entry
+                self.stats["misses"] += 1
+                if len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+                    self.stats["evictions"] += 1
+        statement, order = entry
+        return statement, tuple(params[i]["value"] for i in order)
+
+    @staticmethod
+    def _compile(template: str, params: list, qualifier: str) -> tuple:
+        # conditions are ANDed, so ordering them canonically lets callers that list the
+        # same columns in a different order share one SQL text in sqlite3's cache
+        order = sorted(range(len(params)), key=lambda i: (params[i]["column"], params[i]["op"], i))
+        where = " and ".join(f"{qualifier}{params[i]['column']}{params[i]['op']}?" for i in order)
+        return template.format(where=where), order
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats,
+                        shapes=len(self._shapes),
+                        hit_rate=self.stats["hits"] / lookups if lookups else 0.)
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+shape_cache = StatementShapeCache()
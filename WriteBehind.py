@@ -0,0 +1,302 @@
+import atexit
+import itertools
+import sqlite3
+import threading
+import time
+
+from DataBaseConnection import DataBaseConnection
+import DAOFactoryMethod
+
+
+# attributes the DAOs use to locate the row an object refers to
+ROW_KEYS = {
+    DAOFactoryMethod.GameDAO: ("name", "price"),
+    DAOFactoryMethod.UserDAO: ("login",)
+}
+DEFAULT_ROW_KEY = ("name",)
+
+
+class _GroupConnection:
+    # the DAOs wrap every call in "with con:", which would commit after each
+    # queued call; inside a group the outer transaction decides instead
+    def __init__(self, con: sqlite3.Connection):
+        self._con = con
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+class _WriterConnection:
+    def __init__(self, con: sqlite3.Connection):
+        self.connection = con
+        self.grouped = False
+        self._group_connection = _GroupConnection(con)
+
+    def get_connection(self):
+        return self._group_connection if self.grouped else self.connection
+
+    def get_read_connection(self):
+        return self.get_connection()
+
+
+def _row_key(dao, object_) -> tuple:
+    return tuple(getattr(object_, attr) for attr in ROW_KEYS.get(type(dao), DEFAULT_ROW_KEY))
+
+
+class _Operation:
+    def __init__(self, dao, method: str, args: tuple, ticket: int):
+        self.dao = dao
+        self.method = method
+        self.args = args
+        self.tickets = [ticket]
+        # the queued updates a coalesced A -> C stands for, A -> B and B -> C
+        self.steps = [args]
+
+    def apply(self):
+        if len(self.steps) > 1 and self._intermediate_rows():
+            # rows already holding B would also be moved to C by the calls as queued, A -> C would miss them
+            for args in self.steps:
+                getattr(self.dao, self.method)(*args)
+        else:
+            getattr(self.dao, self.method)(*self.args)
+
+    def _intermediate_rows(self) -> bool:
+        attrs = ROW_KEYS.get(type(self.dao), DEFAULT_ROW_KEY)
+        for _, object_new in self.steps[:-1]:
+            if self.dao.filter([{"column": attr, "value": getattr(object_new, attr), "op": "="} for attr in attrs]):
+                return True
+        return False
+
+
+class WriteBehindBuffer:
+    def __init__(self, dbcon: DataBaseConnection, max_pending: int = 1000, flush_interval: float = 0.05):
+        if not dbcon.db_file_path or dbcon.db_file_path == ":memory:":
+            raise ValueError("Write-behind needs a database file shared with the writer thread.")
+        self._db_file_path = dbcon.db_file_path
+        self._profile = getattr(dbcon, "profile", None)
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Condition()
+        self._operations = list()
+        self._coalesce = dict()
+        self._twins = dict()
+        self._tickets = itertools.count(1)
+        self._last_ticket = 0
+        self._flush_requested = 0
+        self._committed = 0
+        self._failed = dict()
+        self._closed = False
+        self._writer = None
+
+        self.stats = {
+            "queued": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "flushed": 0,
+            "failed": 0,
+            "flush_seconds": 0.
+        }
+
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="write-behind", daemon=True)
+        self._thread.start()
+        ready.wait()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def wrap(self, dao: DAOFactoryMethod.DAO):
+        return WriteBehindDAO(self, dao)
+
+    def submit(self, dao: DAOFactoryMethod.DAO, method: str, *args) -> int:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind buffer is closed.")
+            ticket = next(self._tickets)
+            self._last_ticket = ticket
+            self.stats["queued"] += 1
+            if not self._try_coalesce(dao, method, args, ticket):
+                self._operations.append(_Operation(self._twin(dao), method, args, ticket))
+            if len(self._operations) >= self.max_pending:
+                self._lock.notify_all()
+            return ticket
+
+    def flush(self, wait: bool = True):
+        with self._lock:
+            ticket = self._last_ticket
+            self._flush_requested = max(self._flush_requested, ticket)
+            self._lock.notify_all()
+        if wait:
+            self.wait_durable(ticket)
+
+    def wait_durable(self, ticket: int, timeout: float = None) -> bool:
+        with self._lock:
+            if not self._lock.wait_for(lambda: self._committed >= ticket or not self._thread.is_alive(), timeout):
+                return False
+            if ticket in self._failed:
+                raise self._failed.pop(ticket)
+            return self._committed >= ticket
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._operations)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _try_coalesce(self, dao, method: str, args: tuple, ticket: int) -> bool:
+        # keyed by DAO class, i.e. by table: two DAOs over the same table write the same rows
+        table = type(dao)
+        if method != "update":
+            # an add or remove may change which row a key refers to
+            for key in [key for key in self._coalesce if key[0] is table]:
+                del self._coalesce[key]
+            return False
+
+        object_old, object_new = args
+        operation = self._coalesce.pop((table, _row_key(dao, object_old)), None)
+        # only back to back updates are merged, anything queued in between may touch the rows B or C names
+        if operation is not None and self._operations[-1] is operation:
+            # A -> B followed by B -> C becomes A -> C
+            operation.args = (operation.args[0], object_new)
+            operation.steps.append(args)
+            operation.tickets.append(ticket)
+            self.stats["coalesced"] += 1
+        else:
+            operation = _Operation(self._twin(dao), method, args, ticket)
+            self._operations.append(operation)
+        self._coalesce[(table, _row_key(dao, object_new))] = operation
+        return True
+
+    def _twin(self, dao):
+        # same DAO class bound to the writer thread's connection
+        if dao not in self._twins:
+            self._twins[dao] = type(dao)(self._writer)
+        return self._twins[dao]
+
+    def _run(self, ready: threading.Event):
+        con = DataBaseConnection.connect(self._db_file_path, self._profile)
+        self._writer = _WriterConnection(con)
+        ready.set()
+        try:
+            while True:
+                with self._lock:
+                    self._lock.wait_for(lambda: self._closed
+                                        or len(self._operations) >= self.max_pending
+                                        or self._flush_requested > self._committed,
+                                        self.flush_interval)
+                    operations = self._operations
+                    self._operations = list()
+                    self._coalesce.clear()
+                    ticket = self._last_ticket
+                    closed = self._closed
+                if operations:
+                    self._write(operations)
+                with self._lock:
+                    self._committed = max(self._committed, ticket)
+                    self._lock.notify_all()
+                if closed:
+                    return
+        finally:
+            con.close()
+
+    def _write(self, operations: list):
+        started = time.perf_counter()
+        failed = dict()
+        self._writer.grouped = True
+        try:
+            with self._writer.connection:
+                for operation in operations:
+                    operation.apply()
+        except Exception:
+            # replay one by one so a single bad call does not sink the group
+            self._writer.grouped = False
+            for operation in operations:
+                try:
+                    operation.apply()
+                except Exception as e:
+                    failed.update({ticket: e for ticket in operation.tickets})
+        finally:
+            self._writer.grouped = False
+
+        with self._lock:
+            self._failed.update(failed)
+            self.stats["flushes"] += 1
+            self.stats["flushed"] += len(operations)
+            self.stats["failed"] += len(failed)
+            self.stats["flush_seconds"] += time.perf_counter() - started
+
+
+class WriteBehindDAO(DAOFactoryMethod.DAO):
+    def __init__(self, buffer: WriteBehindBuffer, subject: DAOFactoryMethod.DAO):
+        self._buffer = buffer
+        self._subject = subject
+
+    def get_all(self) -> list:
+        # read your own writes
+        self._buffer.flush()
+        return self._subject.get_all()
+
+    def filter(self, params: list) -> list:
+        self._buffer.flush()
+        return self._subject.filter(params)
+
+    def add(self, object_) -> int:
+        return self._buffer.submit(self._subject, "add", object_)
+
+    def remove(self, object_) -> int:
+        return self._buffer.submit(self._subject, "remove", object_)
+
+    def update(self, object_old, object_new) -> int:
+        return self._buffer.submit(self._subject, "update", object_old, object_new)
+
+    def wait_durable(self, ticket: int, timeout: float = None) -> bool:
+        return self._buffer.wait_durable(ticket, timeout)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    import Game
+
+    # chained updates through the buffer must leave the rows the same calls made directly leave
+    updates = [("A", "B"), ("D", "E"), ("E", "B"), ("B", "Z")]
+    names = dict()
+    for buffered in (False, True):
+        path = os.path.join(tempfile.mkdtemp(), "write_behind.db")
+        dbcon = DataBaseConnection.get_instance()
+        dbcon.open_connection(path, reinit_file=True)
+        dbcon.init_tables()
+        dao = DAOFactoryMethod.GameDAO(dbcon)
+        for name in ("A", "D"):
+            dao.add(Game.Game(name, 1.))
+        if buffered:
+            buffer = WriteBehindBuffer(dbcon, flush_interval=10.)
+            dao = buffer.wrap(dao)
+        for old, new in updates:
+            dao.update(Game.Game(old, 1.), Game.Game(new, 1.))
+        names[buffered] = sorted(row[1] for row in dao.get_all())
+        if buffered:
+            print(buffer.stats)
+            buffer.close()
+        dbcon.close_connection()
+    assert names[True] == names[False], names
+    print(names[True])